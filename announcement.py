@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""announcement.py
+
+Udacity conference server-side Python App Engine nearly sold out
+announcement
+
+The set of nearly sold out conferences (websafeConferenceKey -> name)
+is cached in memcache (see cache.py) and updated incrementally, with
+gets/cas, whenever a registration moves a conference across the nearly
+sold out threshold (see seats.py). When the set is missing or has gone
+stale it is recomputed from the facet summaries (see facets.py) by one
+caller; the cron also rebuilds it as a rare consistency repair.
+
+$Id$
+
+"""
+
+import cache
+
+MEMCACHE_NEARLY_SOLD_OUT_KEY = 'NEARLY_SOLD_OUT'
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+# seconds before the set is recomputed even without a repair
+ANNOUNCEMENT_TTL = 3600
+# per-instance copy of the set, dropped everywhere when it changes
+LOCAL_CACHE = cache.GenerationLRUCache('announcement', max_size=1, ttl=10)
+
+
+def formatAnnouncement(nearly_sold_out):
+    """Return the announcement for a wsck -> name dict, "" if empty."""
+    if not nearly_sold_out:
+        return ""
+    return ANNOUNCEMENT_TPL % ', '.join(sorted(nearly_sold_out.values()))
+
+
+def getNearlySoldOut(compute):
+    """Return the cached wsck -> name dict, computing it with compute()
+    if missing or stale."""
+    nearly_sold_out = LOCAL_CACHE.get(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+    if nearly_sold_out is None:
+        nearly_sold_out = cache.getOrCompute(
+            MEMCACHE_NEARLY_SOLD_OUT_KEY, compute, ANNOUNCEMENT_TTL)
+        LOCAL_CACHE.set(MEMCACHE_NEARLY_SOLD_OUT_KEY, nearly_sold_out)
+    return nearly_sold_out
+
+
+def refreshNearlySoldOut(compute):
+    """Cache the wsck -> name dict compute() returns and return it; a
+    conference added or removed by updateConference() meanwhile keeps
+    the cached set instead.
+    """
+    nearly_sold_out = cache.refresh(MEMCACHE_NEARLY_SOLD_OUT_KEY, compute,
+                                    ANNOUNCEMENT_TTL)
+    LOCAL_CACHE.invalidate()
+    return nearly_sold_out
+
+
+def updateConference(wsck, name, nearly_sold_out):
+    """Add a conference to, or remove it from, the cached set.
+
+    Nothing is done while the set is not cached; it is computed in full
+    on its next read.
+    """
+    changed = []
+
+    def updater(current):
+        if current is None or (wsck in current) == nearly_sold_out:
+            return None
+        updated = dict(current)
+        if nearly_sold_out:
+            updated[wsck] = name
+        else:
+            del updated[wsck]
+        changed.append(True)
+        return updated
+    cache.update(MEMCACHE_NEARLY_SOLD_OUT_KEY, updater, ANNOUNCEMENT_TTL)
+    if changed:
+        LOCAL_CACHE.invalidate()
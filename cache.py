@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Udacity conference server-side Python App Engine caches
+
+LRUCache is a per-instance cache; GenerationLRUCache is one that every
+instance drops within seconds of an invalidate(), by watching a
+generation number in memcache, and KeyedGenerationLRUCache one that
+does so per key. The module functions wrap memcache:
+values are stored with a "fresh until" time and kept for a while after
+it, so a stale value can be served while one caller, holding a
+memcache.add lock, recomputes it (stale-while-revalidate). TTLs are
+jittered so keys set together do not expire together, and updates of
+shared values go through gets/cas loops.
+
+$Id$
+
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from google.appengine.api import memcache
+
+LOCK_PREFIX = 'LOCK:'
+# seconds a recompute lock is held at most
+LOCK_SECONDS = 10
+# seconds a value is still served after it went stale
+STALE_SECONDS = 300
+# fraction by which TTLs are randomly shortened or lengthened
+TTL_JITTER = 0.1
+# attempts at a contended compare-and-set
+CAS_RETRIES = 5
+# how long a caller without the lock waits for the value on a miss
+WAIT_SECONDS = 0.5
+WAIT_INTERVAL = 0.05
+GENERATION_PREFIX = 'GENERATION:'
+# seconds between checks of a GenerationLRUCache's generation
+GENERATION_CHECK_SECONDS = 2
+
+# per-instance caches by name, for stats()
+_local_caches = {}
+
+
+class LRUCache(object):
+    """LRUCache -- thread-safe, size-bounded cache local to one instance
+
+    Entries expire ttl seconds after they were set, so an instance that
+    missed an invalidation still converges on fresh data.
+    """
+
+    def __init__(self, max_size=100, ttl=60, name=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if name:
+            _local_caches[name] = self
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if absent/expired."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                self.misses += 1
+                return default
+            # re-insert to mark as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Cache value under key for ttl seconds (default: self.ttl),
+        evicting the least recently used entry."""
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Drop key from the cache."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the hit and miss counts and current size."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries)}
+
+
+class GenerationLRUCache(LRUCache):
+    """GenerationLRUCache -- LRUCache shared-invalidated through memcache
+
+    invalidate() bumps a generation number in memcache; every instance
+    checks it at most every GENERATION_CHECK_SECONDS and drops all its
+    entries when it moved on. Entries also expire after their own TTL.
+    """
+
+    def __init__(self, name, max_size=100, ttl=10):
+        super(GenerationLRUCache, self).__init__(max_size, ttl, name)
+        self._generation_key = GENERATION_PREFIX + name
+        self._generation = None
+        self._checked = 0
+
+    def _checkGeneration(self):
+        now = time.time()
+        if now - self._checked < GENERATION_CHECK_SECONDS:
+            return
+        self._checked = now
+        generation = memcache.get(self._generation_key)
+        if generation is None:
+            # evicted or never set: start over, as after an invalidation
+            memcache.add(self._generation_key, 0)
+            generation = 0
+        if generation != self._generation:
+            self.clear()
+            self._generation = generation
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if absent, expired
+        or invalidated."""
+        self._checkGeneration()
+        return super(GenerationLRUCache, self).get(key, default)
+
+    def invalidate(self):
+        """Drop every entry, on every instance."""
+        memcache.incr(self._generation_key, initial_value=0)
+        self.clear()
+        self._checked = 0
+
+
+class KeyedGenerationLRUCache(LRUCache):
+    """KeyedGenerationLRUCache -- LRUCache invalidated per key through
+    memcache
+
+    invalidate(key) bumps a generation number kept in memcache for that
+    key alone; an instance checks the generation of an entry it serves
+    at most every GENERATION_CHECK_SECONDS and drops the entry when it
+    moved on. A write thus only evicts what it changed, however often
+    other keys are written. Entries also expire after their own TTL.
+    """
+
+    def __init__(self, name, max_size=100, ttl=10):
+        super(KeyedGenerationLRUCache, self).__init__(max_size, ttl, name)
+        self._generation_prefix = '%s%s:' % (GENERATION_PREFIX, name)
+
+    def _currentGeneration(self, key):
+        generation_key = self._generation_prefix + key
+        generation = memcache.get(generation_key)
+        if generation is None:
+            # evicted or never set: entries stored under an earlier
+            # generation no longer match
+            memcache.add(generation_key, 0)
+            generation = 0
+        return generation
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if absent, expired
+        or invalidated."""
+        entry = super(KeyedGenerationLRUCache, self).get(key)
+        if entry is None:
+            return default
+        value, generation, checked = entry
+        now = time.time()
+        if now - checked >= GENERATION_CHECK_SECONDS:
+            if self._currentGeneration(key) != generation:
+                self.delete(key)
+                return default
+            entry[2] = now
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Cache value under key, as of the key's current generation."""
+        super(KeyedGenerationLRUCache, self).set(
+            key, [value, self._currentGeneration(key), time.time()], ttl)
+
+    def invalidate(self, key):
+        """Drop key, on every instance."""
+        memcache.incr(self._generation_prefix + key, initial_value=0)
+        self.delete(key)
+
+
+def stats():
+    """Return the stats() of every named per-instance cache."""
+    return dict((name, local.stats())
+                for name, local in _local_caches.items())
+
+
+def jitter(ttl):
+    """Return ttl randomly moved by up to TTL_JITTER of itself."""
+    return max(1, int(ttl * random.uniform(1 - TTL_JITTER, 1 + TTL_JITTER)))
+
+
+def _wrap(value, ttl):
+    ttl = jitter(ttl)
+    return (value, time.time() + ttl), ttl + STALE_SECONDS
+
+
+def _unwrap(entry):
+    """Return (value, fresh) of a stored entry, or (None, False) for a
+    miss or a value stored without this module."""
+    if not isinstance(entry, tuple) or len(entry) != 2:
+        return None, False
+    value, fresh_until = entry
+    return value, fresh_until > time.time()
+
+
+def get(key):
+    """Return the value cached under key, stale or not; None on a miss."""
+    return _unwrap(memcache.get(key))[0]
+
+
+def getMulti(keys, key_prefix=''):
+    """Return a dict of key -> value for the keys cached, stale or not."""
+    entries = memcache.get_multi(keys, key_prefix=key_prefix)
+    values = {}
+    for key, entry in entries.items():
+        value, _ = _unwrap(entry)
+        if value is not None:
+            values[key] = value
+    return values
+
+
+def addMulti(mapping, ttl, key_prefix=''):
+    """Cache every key -> value of mapping that is not cached yet; each
+    value is fresh for about ttl seconds, and a value stored meanwhile
+    by another caller is kept."""
+    entries = {}
+    for key, value in mapping.items():
+        entries[key], time_ = _wrap(value, ttl)
+    memcache.add_multi(entries, time=time_, key_prefix=key_prefix)
+
+
+def _lock(key):
+    return memcache.add(LOCK_PREFIX + key, 1, time=LOCK_SECONDS)
+
+
+def _unlock(key):
+    memcache.delete(LOCK_PREFIX + key)
+
+
+def _store(client, key, entry, value, ttl):
+    """Store value under key, read as entry with client.gets(), unless
+    it changed since: a miss is filled with add, a hit replaced with
+    cas. Returns True if value was stored."""
+    new_entry, time_ = _wrap(value, ttl)
+    if entry is None:
+        return client.add(key, new_entry, time=time_)
+    return client.cas(key, new_entry, time=time_)
+
+
+def refresh(key, compute, ttl):
+    """Cache compute() under key and return it; if the value cached
+    under key changed while compute() ran (e.g. through update()), the
+    newer value is kept instead of the recomputed one."""
+    client = memcache.Client()
+    entry = client.gets(key)
+    value = compute()
+    _store(client, key, entry, value, ttl)
+    return value
+
+
+def getOrCompute(key, compute, ttl):
+    """Return the value cached under key, computing and caching it with
+    compute() when missing or stale.
+
+    Only the caller that takes the key's lock recomputes, and its value
+    does not replace one an update() stored meanwhile. While it does,
+    others are served the stale value; on a miss they wait up to
+    WAIT_SECONDS for it, then compute it themselves without caching.
+    compute() must not return None.
+    """
+    client = memcache.Client()
+    entry = client.gets(key)
+    value, fresh = _unwrap(entry)
+    if fresh:
+        return value
+    if _lock(key):
+        try:
+            # stored like refresh(), so an update() made meanwhile wins
+            value = compute()
+            _store(client, key, entry, value, ttl)
+            return value
+        finally:
+            _unlock(key)
+    if value is not None:
+        return value
+
+    waited = 0
+    while waited < WAIT_SECONDS:
+        time.sleep(WAIT_INTERVAL)
+        waited += WAIT_INTERVAL
+        value = get(key)
+        if value is not None:
+            return value
+    return compute()
+
+
+def update(key, updater, ttl):
+    """Replace the value cached under key with updater(value) in a
+    gets/cas loop; value is None on a miss, and updater returns None to
+    leave the cache unchanged. Returns the stored value, or None if
+    nothing was stored. If the update keeps losing races the key is
+    dropped, so the next reader recomputes it.
+    """
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        current, _ = _unwrap(client.gets(key))
+        value = updater(current)
+        if value is None:
+            return None
+        entry, time_ = _wrap(value, ttl)
+        if current is None:
+            stored = client.add(key, entry, time=time_)
+        else:
+            stored = client.cas(key, entry, time=time_)
+        if stored:
+            return value
+    memcache.delete(key)
+    return None
@@ -13,20 +13,29 @@ created by wesc on 2014 apr 21
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
+import calendar
+import json
+import logging
+import time
 from functools import wraps
-from datetime import datetime, time
+from datetime import datetime
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.datastore import entity_pb
 from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
 
 from models import ConflictException
 from models import Profile
+from models import Registration
+from models import WishlistEntry
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import StringMessage
@@ -35,6 +44,10 @@ from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForms
+from models import QueryPlanForm
+from models import FacetCountForm
+from models import FacetForm
+from models import ConferenceFacetsForm
 from models import TeeShirtSize
 from models import Session
 from models import SessionForm
@@ -42,6 +55,15 @@ from models import SessionForms
 from models import SessionByTypeQueryForm
 from models import SpeakerQueryForm
 from models import SessionByDurationQueryForm
+from models import SessionRangeQueryForm
+from models import SpeakerTally
+from models import ConferenceKeysForm
+from models import FeaturedSpeakerForm
+from models import FeaturedSpeakerForms
+from models import RegistrationResultForm
+from models import RegistrationResultForms
+from models import BulkResultForm
+from models import BulkResultForms
 from models import Speaker
 from models import SpeakerForm
 from models import SpeakerForms
@@ -53,13 +75,56 @@ from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
 
+import announcement
+import cache
+import emailqueue
+import facets
+import search
+import seats
+import speakerindex
+import versions
+from planner import planQuery
+from sessionrange import SessionRange
+from serializers import CONFERENCE_SERIALIZER
+from serializers import PROFILE_SERIALIZER
+from serializers import SESSION_SERIALIZER
+from serializers import SPEAKER_SERIALIZER
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
 MEMCACHE_FEATURED_SPEAKER_KEY = 'FEATURED_SPEAKER'
+MEMCACHE_FEATURED_SPEAKER_PREFIX = 'FEATURED_SPEAKER:'
+MEMCACHE_DISPLAY_NAME_PREFIX = 'DISPLAY_NAME:'
+# seconds an organizer name is cached; a name read before a rename and
+# cached after it is served until then
+DISPLAY_NAME_TTL = 600
+MEMCACHE_SCHEDULE_PREFIX = 'SCHEDULE:'
+# seconds a conference schedule is kept in memcache
+SCHEDULE_TTL = 600
+# per-instance copy of recently read conference schedules
+SCHEDULE_CACHE = cache.LRUCache(max_size=200, ttl=30, name='schedule')
+# per-instance copies of hot reads; a change drops the entries of the
+# keys it changed on every instance
+CONFERENCE_CACHE = cache.KeyedGenerationLRUCache(
+    'conference', max_size=500, ttl=5)
+FEATURED_SPEAKER_CACHE = cache.KeyedGenerationLRUCache(
+    'featured_speaker', max_size=1000, ttl=10)
 FEATURED_TPL = '%s is the featured speaker for the following sessions: %s'
+# featured speaker tasks for one conference are merged per window (seconds)
+FEATURED_SPEAKER_WINDOW = 10
+# seconds a cached featured speaker is fresh; tasks update it on change
+FEATURED_SPEAKER_TTL = 24 * 3600
+SPEAKER_TALLY_ID = 'speakers'
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# page tokens are tagged with the kind of position they hold, so one
+# paging method never misreads another's token
+CURSOR_TOKEN = 'c'
+OFFSET_TOKEN = 'o'
+# bulk creates take at most MAX_BULK_ITEMS items, written BULK_CHUNK_SIZE
+# at a time
+MAX_BULK_ITEMS = 200
+BULK_CHUNK_SIZE = 50
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -85,11 +150,39 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+# Properties fetched by projection queries when the requested fields
+# allow it; index.yaml holds a composite index for every query shape
+# the planner produces (no filter, or filters on a single one of FIELDS).
+# Repeated and long properties (topics, description) are never projected.
+CONFERENCE_PROJECTION = ('city', 'endDate', 'maxAttendees', 'month', 'name',
+                         'organizerUserId', 'seatsAvailable', 'startDate')
+CONFERENCE_PROJECTED_FIELDS = frozenset(
+    CONFERENCE_PROJECTION + ('websafeKey', 'organizerDisplayName'))
+SESSION_PROJECTION = ('duration', 'location', 'name', 'sess_date',
+                      'sess_time', 'sess_type')
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_VERSIONED_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    knownVersion=messages.IntegerField(2),
+)
+
+PROFILE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    knownVersion=messages.IntegerField(1),
+)
+
+CONF_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -100,11 +193,23 @@ SESSION_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1)
 )
 
+SESSION_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    select=messages.StringField(2, repeated=True),
+    knownVersion=messages.IntegerField(3)
+)
+
 SESSION_POST_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     websafeConferenceKey=messages.StringField(1)
 )
 
+SESSION_BULK_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1)
+)
+
 SESSION_BY_TYPE_REQUEST = endpoints.ResourceContainer(
     SessionByTypeQueryForm,
     websafeConferenceKey=messages.StringField(1)
@@ -115,11 +220,37 @@ WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
     websafeSessionKey=messages.StringField(1)
 )
 
+WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    pageToken=messages.StringField(2)
+)
+
+SESSION_RANGE_REQUEST = endpoints.ResourceContainer(
+    SessionRangeQueryForm,
+    websafeConferenceKey=messages.StringField(1)
+)
+
 DURATION_POST_REQUEST = endpoints.ResourceContainer(
     SessionByDurationQueryForm,
     websafeConferenceKey=messages.StringField(1)
 )
 
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1, required=True),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+SESSION_SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1, required=True),
+    websafeConferenceKey=messages.StringField(2),
+    pageSize=messages.IntegerField(3),
+    pageToken=messages.StringField(4),
+)
+
 SPEAKER_POST_REQUEST = endpoints.ResourceContainer(
     SpeakerForm,
     websafeSessionKey=messages.StringField(1)
@@ -161,32 +292,57 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
-        """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+    def _copyConferencesToForms(self, confs, fields=None, defaults=None,
+                                names_future=None):
+        """Copy Conferences to ConferenceForms, resolving organizer names
+        and live seat counts in one concurrent batch each.
 
+        fields, if given, limits the copied fields; defaults holds field
+        values shared by every conference (e.g. equality filter values
+        a projection query could not return). names_future is an already
+        started _getOrganizerNamesAsync() lookup for confs.
+        """
+        extras = [dict(defaults or {}) for conf in confs]
+        if fields is not None and defaults:
+            # never read defaulted fields from (projected) entities
+            fields = fields - frozenset(defaults)
+        seats_future = None
+        if fields is None or 'organizerDisplayName' in fields:
+            names_future = names_future or self._getOrganizerNamesAsync(
+                [conf.organizerUserId for conf in confs])
+        else:
+            names_future = None
+        if fields is None or 'seatsAvailable' in fields:
+            seats_future = seats.getSeatsMultiAsync(confs)
+
+        if names_future:
+            names = names_future.get_result()
+            for conf, conf_extras in zip(confs, extras):
+                conf_extras['organizerDisplayName'] = \
+                    names.get(conf.organizerUserId)
+        if seats_future:
+            seats_available = seats_future.get_result()
+            for conf, conf_extras in zip(confs, extras):
+                conf_extras['seatsAvailable'] = seats_available[conf.key]
+        return CONFERENCE_SERIALIZER.to_forms(confs, extras, fields)
 
-    def _createConferenceObject(self, request):
-        """Create or update Conference object, returning ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
 
+    @staticmethod
+    def _checkFields(fields, serializer):
+        """Return the requested response fields, or None for all of them."""
+        if not fields:
+            return None
+        unknown = set(fields) - serializer.field_names
+        if unknown:
+            raise endpoints.BadRequestException(
+                'Unknown select fields: %s' % ', '.join(sorted(unknown)))
+        return frozenset(fields)
+
+
+    def _conferenceData(self, request, user_id):
+        """Check a ConferenceForm and return the properties of the new
+        Conference it describes, less its key; defaults are also filled
+        into request."""
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
@@ -194,6 +350,8 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['version']
+        del data['notModified']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -202,37 +360,158 @@ class ConferenceApi(remote.Service):
                 setattr(request, df, DEFAULTS[df])
 
         # convert dates from strings to Date objects; set month based on start_date
-        if data['startDate']:
-            data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
-            data['month'] = data['startDate'].month
-        else:
-            data['month'] = 0
-        if data['endDate']:
-            data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        try:
+            if data['startDate']:
+                data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
+                data['month'] = data['startDate'].month
+            else:
+                data['month'] = 0
+            if data['endDate']:
+                data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Conference dates must be formatted as YYYY-MM-DD.")
 
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
+        data['organizerUserId'] = request.organizerUserId = user_id
+        return data
+
+
+    def _createConferenceObject(self, request):
+        """Create or update Conference object, returning ConferenceForm/request."""
+        # preload necessary data items
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        data = self._conferenceData(request, user_id)
+
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
         p_key = ndb.Key(Profile, user_id)
         c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
-        data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        # create Conference and its seat counters concurrently
+        futures = [Conference(**data).put_async(),
+                   seats.initSeatsAsync(c_key, data['seatsAvailable'])]
+        for future in futures:
+            future.get_result()
+
+        # then queue its facet and search updates in one batch, and the
+        # email to organizer confirming creation of Conference
+        rpcs = [taskqueue.Queue().add_async([
+                    facets.refreshTask(c_key.urlsafe()),
+                    search.indexTask(c_key.urlsafe())]),
+                emailqueue.enqueueEmailAsync(
+                    emailqueue.CONFERENCE_CREATED, user.email(), [c_key])]
+        for rpc in rpcs:
+            rpc.get_result()
+        # return (modified) ConferenceForm
         return request
 
 
-    @ndb.transactional()
+    def _createConferenceObjects(self, request):
+        """Create many Conferences, returning a result per ConferenceForm.
+
+        Ids come from one allocate_ids range, Conferences and their seat
+        shards are written BULK_CHUNK_SIZE conferences at a time, and a
+        single task does the follow-up work for all of them.
+        """
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        if len(request.items) > MAX_BULK_ITEMS:
+            raise endpoints.BadRequestException(
+                'At most %d conferences can be created at once.' % MAX_BULK_ITEMS)
+
+        # check every form; invalid ones are reported, not created
+        results = [BulkResultForm(index=i, data=False)
+                   for i in range(len(request.items))]
+        valid = []
+        for result, form in zip(results, request.items):
+            try:
+                valid.append((result, form, self._conferenceData(form, user_id)))
+            except endpoints.BadRequestException as e:
+                result.message = str(e)
+        if not valid:
+            return BulkResultForms(items=results)
+
+        p_key = ndb.Key(Profile, user_id)
+        first, _ = Conference.allocate_ids(size=len(valid), parent=p_key)
+        confs = []
+        for c_id, (result, form, data) in enumerate(valid, first):
+            data['key'] = ndb.Key(Conference, c_id, parent=p_key)
+            confs.append(Conference(**data))
+            result.websafeKey = data['key'].urlsafe()
+
+        # a failed write is reported for its conference only; the rest
+        # of the batch goes on, so every stored conference gets its
+        # follow-up work below
+        stored = []
+        for i in range(0, len(confs), BULK_CHUNK_SIZE):
+            chunk = confs[i:i + BULK_CHUNK_SIZE]
+            puts = ndb.put_multi_async(chunk)
+            shards = [seats.initSeatsAsync(conf.key, conf.seatsAvailable)
+                      for conf in chunk]
+            ndb.Future.wait_all(puts + shards)
+            for conf, put, init, (result, _, _) in zip(
+                    chunk, puts, shards, valid[i:i + BULK_CHUNK_SIZE]):
+                error = put.get_exception()
+                if error is None and init.get_exception() is not None:
+                    # a partly written shard set would be taken for one
+                    # holding reservations (see seats.py): write it
+                    # again, or drop the conference
+                    error = seats.initSeatsAsync(
+                        conf.key, conf.seatsAvailable).get_exception()
+                    if error is not None and \
+                            conf.key.delete_async().get_exception():
+                        logging.error('Conference %s without seat shards '
+                                      'not deleted', result.websafeKey)
+                if error is not None:
+                    logging.warning('Conference %s not stored: %s',
+                                    result.websafeKey, error)
+                    result.websafeKey = None
+                    result.message = 'Not stored, please try again.'
+                    continue
+                result.data = True
+                stored.append(conf)
+        if not stored:
+            return BulkResultForms(items=results)
+
+        # one task refreshes facets and search for all of them, and one
+        # email confirms them all
+        rpcs = [taskqueue.Task(params={'websafeConferenceKeys': json.dumps(
+                    [conf.key.urlsafe() for conf in stored])},
+                    url='/tasks/conferences_created').add_async(),
+                emailqueue.enqueueEmailAsync(
+                    emailqueue.CONFERENCE_CREATED, user.email(),
+                    [conf.key for conf in stored])]
+        for rpc in rpcs:
+            rpc.get_result()
+        return BulkResultForms(items=results)
+
+
     def _updateConferenceObject(self, request):
+        """Update Conference object, returning ConferenceForm."""
+        conf, old_max = self._saveConferenceUpdate(request)
+
+        # keep the seat counters in step with a changed maxAttendees
+        if conf.maxAttendees != old_max:
+            seats.adjustSeats(conf, (conf.maxAttendees or 0) - (old_max or 0))
+        CONFERENCE_CACHE.invalidate(request.websafeConferenceKey)
+
+        return self._copyConferencesToForms([conf])[0]
+
+
+    @ndb.transactional()
+    def _saveConferenceUpdate(self, request):
+        """Copy provided fields onto the Conference; return it with its
+        previous maxAttendees."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
@@ -255,7 +534,13 @@ class ConferenceApi(remote.Service):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        old_max = conf.maxAttendees
+        old_facets = facets.facetIds(conf)
         for field in request.all_fields():
+            # seats are owned by the seat counters (see seats.py), the
+            # version by this method
+            if field.name in ('seatsAvailable', 'version', 'notModified'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -266,9 +551,14 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+        conf.version += 1
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        versions.publishOnCommit(versions.CONFERENCE,
+                                 request.websafeConferenceKey, conf.version)
+        facets.enqueueRefresh(request.websafeConferenceKey, old_facets,
+                              transactional=True)
+        search.enqueueIndex(request.websafeConferenceKey, transactional=True)
+        return conf, old_max
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
@@ -278,6 +568,13 @@ class ConferenceApi(remote.Service):
         return self._createConferenceObject(request)
 
 
+    @endpoints.method(ConferenceForms, BulkResultForms, path='conferences',
+            http_method='POST', name='createConferences')
+    def createConferences(self, request):
+        """Create many conferences at once; returns a result per item."""
+        return self._createConferenceObjects(request)
+
+
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
@@ -286,26 +583,63 @@ class ConferenceApi(remote.Service):
         return self._updateConferenceObject(request)
 
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @endpoints.method(CONF_VERSIONED_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
+        """Return requested conference (by websafeConferenceKey); only
+        its live seat count and organizer name if knownVersion is still
+        current."""
+        wsck = request.websafeConferenceKey
+        # seat counts (see seats.py) and the organizer's name, which a
+        # Profile update changes without bumping its conferences, are
+        # not versioned, so both are always read and sent
+        if versions.isCurrent(versions.CONFERENCE, wsck,
+                              request.knownVersion):
+            c_key = ndb.Key(urlsafe=wsck)
+            organizer_id = c_key.parent().id()
+            names_future = self._getOrganizerNamesAsync([organizer_id])
+            # only the key is known here, so a conference without seat
+            # shards gets None and the full read
+            seats_available = seats.getSeatsMulti(
+                [Conference(key=c_key)], fallback=False)[c_key]
+            if seats_available is not None:
+                return ConferenceForm(
+                    websafeKey=wsck,
+                    version=request.knownVersion,
+                    seatsAvailable=seats_available,
+                    organizerDisplayName=names_future.get_result().get(
+                        organizer_id),
+                    notModified=True)
+
+        # recently read conferences are served from this instance; their
+        # seat counts may lag by up to the cache's TTL
+        form = CONFERENCE_CACHE.get(wsck)
+        if form:
+            return form
+
+        # the organizer is the parent Profile, so look up their name
+        # while the Conference itself is read
+        c_key = ndb.Key(urlsafe=wsck)
+        names_future = self._getOrganizerNamesAsync([c_key.parent().id()])
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = c_key.get()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        # return ConferenceForm, which must not be modified once cached
+        form = self._copyConferencesToForms(
+            [conf], names_future=names_future)[0]
+        CONFERENCE_CACHE.set(wsck, form)
+        versions.publish(versions.CONFERENCE, wsck, conf.version)
+        return form
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_PAGE_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
-        """Return conferences created by user."""
+        """Return conferences created by user, one page at a time."""
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -313,38 +647,128 @@ class ConferenceApi(remote.Service):
         user_id = getUserId(user)
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        q = Conference.query(ancestor=ndb.Key(Profile, user_id))
+        confs, next_token = self._fetchPage(q, request)
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
+            items=self._copyConferencesToForms(confs),
+            nextPageToken=next_token
         )
 
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+    @staticmethod
+    @ndb.tasklet
+    def _getOrganizerNamesAsync(user_ids):
+        """Return a future dict of organizer user id -> displayName.
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+        Names are served from memcache where possible; the remaining
+        organizer Profiles are read with a single get_multi and cached
+        for DISPLAY_NAME_TTL seconds, unless a name was cached meanwhile.
+        """
+        ctx = ndb.get_context()
+        user_ids = list(set(user_ids))
+        # memcache gets issued together are batched into one RPC
+        cached = yield [ctx.memcache_get(MEMCACHE_DISPLAY_NAME_PREFIX + user_id)
+                        for user_id in user_ids]
+        names = dict((user_id, name) for user_id, name in zip(user_ids, cached)
+                     if name is not None)
+
+        missing = [user_id for user_id in user_ids if user_id not in names]
+        if missing:
+            profiles = yield ndb.get_multi_async(
+                [ndb.Key(Profile, user_id) for user_id in missing])
+            fetched = {}
+            for profile in profiles:
+                # organizers without a Profile are left unresolved
+                if profile:
+                    fetched[profile.key.id()] = profile.displayName
+            yield [ctx.memcache_add(MEMCACHE_DISPLAY_NAME_PREFIX + user_id,
+                                    name, time=DISPLAY_NAME_TTL)
+                   for user_id, name in fetched.items()]
+            names.update(fetched)
+        raise ndb.Return(names)
+
+
+    def _pageSize(self, request):
+        """Return the requested page size, clamped to MAX_PAGE_SIZE."""
+        page_size = request.pageSize
+        if page_size is None:
+            return DEFAULT_PAGE_SIZE
+        if page_size < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        return min(page_size, MAX_PAGE_SIZE)
+
+
+    def _fetchPage(self, query, request, **options):
+        """Fetch one page of query results using the request's page token;
+        options (e.g. keys_only) are passed on to fetch_page(). query may
+        also be a planner.QueryPlan.
+
+        Returns (results, nextPageToken); the token is None on the last page.
+        """
+        cursor = None
+        payload = self._pageToken(request, CURSOR_TOKEN)
+        if payload:
+            try:
+                cursor = ndb.Cursor(urlsafe=payload)
+            except datastore_errors.BadValueError:
+                raise endpoints.BadRequestException("Invalid 'pageToken'.")
+        fetch_page = getattr(query, 'fetchPage', None) or query.fetch_page
+        try:
+            results, next_cursor, more = fetch_page(
+                self._pageSize(request), start_cursor=cursor, **options)
+        except datastore_errors.BadRequestError:
+            raise endpoints.BadRequestException("Invalid 'pageToken'.")
+        if more and next_cursor:
+            return results, '%s.%s' % (CURSOR_TOKEN, next_cursor.urlsafe())
+        return results, None
+
+
+    def _pageList(self, items, request):
+        """Return one page of an in-memory list, with an opaque offset
+        page token.
+
+        Returns (page, nextPageToken); the token is None on the last page.
+        """
+        offset = 0
+        payload = self._pageToken(request, OFFSET_TOKEN)
+        if payload:
+            try:
+                offset = int(payload)
+            except ValueError:
+                raise endpoints.BadRequestException("Invalid 'pageToken'.")
+            if offset < 0:
+                raise endpoints.BadRequestException("Invalid 'pageToken'.")
+        end = offset + self._pageSize(request)
+        next_token = None
+        if end < len(items):
+            next_token = '%s.%d' % (OFFSET_TOKEN, end)
+        return items[offset:end], next_token
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+
+    @staticmethod
+    def _pageTokenKind(request):
+        """Return the kind of the request's page token (CURSOR_TOKEN or
+        OFFSET_TOKEN), or None without one."""
+        if not request.pageToken:
+            return None
+        return request.pageToken.partition('.')[0]
+
+
+    def _pageToken(self, request, kind):
+        """Return the position held by the request's page token, or None
+        without one; a token of another kind is rejected."""
+        if not request.pageToken:
+            return None
+        token_kind, _, payload = request.pageToken.partition('.')
+        if token_kind != kind or not payload:
+            raise endpoints.BadRequestException("Invalid 'pageToken'.")
+        return payload
 
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -354,19 +778,15 @@ class ConferenceApi(remote.Service):
                 filtr["operator"] = OPERATORS[filtr["operator"]]
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
-
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter value must be a number.")
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
@@ -374,41 +794,129 @@ class ConferenceApi(remote.Service):
             http_method='POST',
             name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time.
+
+        The query planner pushes the most selective indexable filter to
+        the datastore and applies the others in memory; 'explain' adds
+        the chosen plan to the response. If 'select' only names fields a
+        projection query can return, only those properties are read from
+        the datastore; otherwise full entities are used. A lone equality
+        filter on city, month or topics is served from its facet instead.
+        Page tokens say which of the two served the first page, so the
+        rest of the pages come from the same one.
+        """
+        fields = self._checkFields(request.select, CONFERENCE_SERIALIZER)
+        filters = self._formatFilters(request.filters)
+        if not request.explain and \
+                self._pageTokenKind(request) != CURSOR_TOKEN:
+            forms = self._queryFacet(filters, request, fields)
+            if forms:
+                return forms
+
+        plan = planQuery(filters)
+        projection, defaults = self._conferenceProjection(plan, fields)
+        conferences, next_token = self._fetchPage(
+            plan, request, projection=projection)
+
+        # return individual ConferenceForm object per Conference,
+        # with organiser displayName fetched from profiles
+        forms = ConferenceForms(
+                items=self._copyConferencesToForms(conferences, fields,
+                                                   defaults),
+                nextPageToken=next_token
+        )
+        if request.explain:
+            pushed, post_filters, order = plan.describe()
+            forms.plan = QueryPlanForm(
+                pushedFilters=pushed, postFilters=post_filters, order=order,
+                projection=projection is not None,
+                scanned=plan.scanned, returned=plan.returned)
+        return forms
+
+
+    def _queryFacet(self, filters, request, fields):
+        """Return the queryConferences page for a single facet filter,
+        or None if the query cannot be served from facets."""
+        if len(filters) != 1:
+            return None
+        filtr = filters[0]
+        if filtr["operator"] != "=" or filtr["field"] not in facets.FACET_FIELDS:
+            return None
+        summaries = facets.getSummaries(filtr["field"], filtr["value"])
+        if summaries is None:
+            # a facet dropped while paging through it has no conferences
+            # left; until /crons/rebuild_facets has backfilled the facets,
+            # and for values without conferences, the query is used
+            if request.pageToken:
+                return ConferenceForms(items=[])
+            return None
+
+        # summaries only hold what is needed to pick the page; its
+        # conferences are read with one get_multi
+        page, next_token = self._pageList(
+            facets.sortedSummaries(summaries), request)
+        confs = [conf for conf in ndb.get_multi(
+            [ndb.Key(urlsafe=wsck) for wsck, _ in page]) if conf]
+        return ConferenceForms(
+            items=self._copyConferencesToForms(confs, fields),
+            nextPageToken=next_token
+        )
 
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+    @endpoints.method(ConferenceQueryForms, ConferenceFacetsForm,
+            path='conferenceFacets',
+            http_method='POST',
+            name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return the number of conferences matching the filters, by city,
+        topic, month and seats available bucket.
 
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
-        )
+        Counts come from the materialized facets (see facets.py) and may
+        briefly lag conference changes.
+        """
+        total, counts = facets.countFacets(
+            self._formatFilters(request.filters))
+        # most common values first
+        return ConferenceFacetsForm(total=total, facets=[
+            FacetForm(field=field, counts=[
+                FacetCountForm(value='%s' % value, count=count)
+                for value, count in sorted(
+                    counts[field].items(), key=lambda item: (-item[1], item[0]))])
+            for field in sorted(counts)])
+
+
+    def _conferenceProjection(self, plan, fields):
+        """Return (projection, defaults) for a queryConferences plan.
+
+        projection is None when full entities are needed. A property in
+        a pushed equality filter cannot be projected; its value is the
+        filter value, returned in defaults instead.
+        """
+        if not fields or not fields <= CONFERENCE_PROJECTED_FIELDS:
+            return None, None
+
+        defaults = {}
+        excluded = plan.equality_field
+        if excluded and excluded in fields:
+            defaults[excluded] = plan.pushed[0]["value"]
+        projection = [prop for prop in CONFERENCE_PROJECTION
+                      if prop != excluded]
+
+        # post-filters are evaluated on the projected entities
+        for filtr in plan.post_filters:
+            if filtr["field"] not in projection:
+                return None, None
+        return projection, defaults
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        # registrations are Profile children keyed by websafeConferenceKey
+        return PROFILE_SERIALIZER.to_form(prof, conferenceKeysToAttend=[
+            r_key.id() for r_key in
+            Registration.query(ancestor=prof.key).iter(keys_only=True)])
 
 
     @authentication_required
@@ -429,9 +937,29 @@ class ConferenceApi(remote.Service):
             )
             profile.put()
 
+        # move legacy membership lists into their own entities
+        if profile.conferenceKeysToAttend or profile.session_wishlist:
+            profile = self._migrateMemberships(p_key)
+
         return profile      # return Profile
 
 
+    @staticmethod
+    @ndb.transactional()
+    def _migrateMemberships(p_key):
+        """Move Profile membership lists into Registration and
+        WishlistEntry children; return the updated Profile."""
+        profile = p_key.get()
+        entries = [Registration(id=wsck, parent=p_key)
+                   for wsck in profile.conferenceKeysToAttend]
+        entries.extend(WishlistEntry(id=s_key, parent=p_key)
+                       for s_key in profile.session_wishlist)
+        profile.conferenceKeysToAttend = []
+        profile.session_wishlist = []
+        ndb.put_multi(entries + [profile])
+        return profile
+
+
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
         # get user Profile
@@ -439,25 +967,55 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
-            for field in ('displayName', 'teeShirtSize'):
-                if hasattr(save_request, field):
-                    val = getattr(save_request, field)
-                    if val:
-                        setattr(prof, field, str(val))
-                        #if field == 'teeShirtSize':
-                        #    setattr(prof, field, str(val).upper())
-                        #else:
-                        #    setattr(prof, field, val)
-                        prof.put()
+            old_name = prof.displayName
+            prof = self._saveProfileFields(prof.key, save_request)
+            # drop the cached organizer name once the new one is stored
+            if prof.displayName != old_name:
+                memcache.delete(MEMCACHE_DISPLAY_NAME_PREFIX + prof.key.id())
 
         # return ProfileForm
+        versions.publish(versions.PROFILE, prof.key.id(), prof.version)
         return self._copyProfileToForm(prof)
 
 
-    @endpoints.method(message_types.VoidMessage, ProfileForm,
+    @staticmethod
+    def _profileChanged(prof):
+        """Bump the version of a Profile whose registrations changed in
+        the current transaction, and publish it on commit."""
+        prof.version += 1
+        prof.put()
+        versions.publishOnCommit(versions.PROFILE, prof.key.id(),
+                                 prof.version)
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _saveProfileFields(p_key, save_request):
+        """Copy user-modifyable fields onto the Profile; return it."""
+        prof = p_key.get()
+        changed = False
+        for field in ('displayName', 'teeShirtSize'):
+            val = getattr(save_request, field, None)
+            if val:
+                setattr(prof, field, str(val))
+                changed = True
+        if changed:
+            prof.version += 1
+            prof.put()
+            versions.publishOnCommit(versions.PROFILE, p_key.id(),
+                                     prof.version)
+        return prof
+
+
+    @endpoints.method(PROFILE_GET_REQUEST, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
     def getProfile(self, request):
-        """Return user profile."""
+        """Return user profile; only its version if knownVersion is
+        still current."""
+        user = endpoints.get_current_user()
+        if user and versions.isCurrent(versions.PROFILE, getUserId(user),
+                                       request.knownVersion):
+            return ProfileForm(version=request.knownVersion, notModified=True)
         return self._doProfile()
 
 
@@ -471,28 +1029,34 @@ class ConferenceApi(remote.Service):
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+    def _nearlySoldOut():
+        """Return a websafeConferenceKey -> name dict of the nearly sold
+        out conferences, from the facet summaries."""
+        # summaries hold every conference's name and seats bucket, and
+        # are read in one get_multi
+        summaries = facets.summariesInBucket(seats.NEARLY_SOLD_OUT)
+        if summaries is not None:
+            return dict((wsck, summary.get('name'))
+                        for wsck, summary in summaries.items())
+
+        # until the facets are backfilled, check the seat counters of
+        # every conference that has seats at all
+        confs = Conference.query(Conference.maxAttendees > 0).fetch()
+        seats_available = seats.getSeatsMulti(confs)
+        return dict(
+            (conf.key.urlsafe(), conf.name) for conf in confs
+            if seats.seatsBucket(seats_available[conf.key]) ==
+            seats.NEARLY_SOLD_OUT)
+
 
-        return announcement
+    @staticmethod
+    def _cacheAnnouncement():
+        """Rebuild the nearly sold out set in memcache and return the
+        announcement; used by the repair cron job.
+        """
+        nearly_sold_out = announcement.refreshNearlySoldOut(
+            ConferenceApi._nearlySoldOut)
+        return announcement.formatAnnouncement(nearly_sold_out)
 
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
@@ -500,81 +1064,83 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        return StringMessage(data=announcement.formatAnnouncement(
+            announcement.getNearlySoldOut(self._nearlySoldOut)))
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
-        prof = self._getProfileFromUser() # get user Profile
-
         # check if conf exists given websafeConfKey
-        # get conference; check that it exists
+        # get conference; check that it exists. This is done outside the
+        # transaction: the Conference lives in its organizer's entity
+        # group, which registration never writes.
         wsck = request.websafeConferenceKey
         conf = ndb.Key(urlsafe=wsck).get()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        return self._updateRegistration(conf, reg)
+
+
+    @ndb.transactional(xg=True)
+    def _updateRegistration(self, conf, reg):
+        """Update user Registration and seat counters for a registration."""
+        retval = None
+        prof = self._getProfileFromUser() # get user Profile
+        r_key = ndb.Key(Registration, conf.key.urlsafe(), parent=prof.key)
+        registration = r_key.get()
 
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if registration:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            # take away one seat if seats avail
+            if not seats.reserveSeat(conf):
                 raise ConflictException(
                     "There are no seats available.")
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
+            # register user
+            Registration(key=r_key).put()
+            self._profileChanged(prof)
             retval = True
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if registration:
 
                 # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
+                r_key.delete()
+                seats.releaseSeat(conf)
+                self._profileChanged(prof)
                 retval = True
             else:
                 retval = False
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
         return BooleanMessage(data=retval)
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_PAGE_REQUEST, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
-        """Get list of conferences that user has registered for."""
+        """Get list of conferences that user has registered for, one page
+        at a time."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        r_keys, next_token = self._fetchPage(
+            Registration.query(ancestor=prof.key), request, keys_only=True)
+        conf_keys = [ndb.Key(urlsafe=r_key.id()) for r_key in r_keys]
+        # skip conferences that have been deleted since registration
+        conferences = [conf for conf in ndb.get_multi(conf_keys) if conf]
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
+        return ConferenceForms(items=self._copyConferencesToForms(conferences),
+         nextPageToken=next_token
         )
 
 
@@ -594,6 +1160,157 @@ class ConferenceApi(remote.Service):
         return self._conferenceRegistration(request, reg=False)
 
 
+    def _batchRegistration(self, request, reg=True):
+        """Register or unregister user for many conferences at once.
+
+        Conferences are read with one get_multi and the Profile is
+        written once. Each seat change runs in its own small transaction,
+        all in parallel: a seat reservation may touch every shard of its
+        conference, so they cannot share one xg transaction.
+        """
+        prof = self._getProfileFromUser() # get user Profile
+        results = {}
+
+        # parse keys; report malformed ones instead of failing the batch
+        wscks = []
+        c_keys = []
+        for wsck in set(request.websafeConferenceKeys):
+            try:
+                c_keys.append(ndb.Key(urlsafe=wsck))
+                wscks.append(wsck)
+            except (TypeError, ProtocolBufferDecodeError):
+                results[wsck] = (False, 'Invalid conference key.')
+
+        # read conferences and existing registrations in one batch
+        entities = ndb.get_multi(
+            c_keys + [ndb.Key(Registration, wsck, parent=prof.key)
+                      for wsck in wscks])
+        conf_list, registrations = entities[:len(wscks)], entities[len(wscks):]
+
+        confs = {}
+        for wsck, conf, registration in zip(wscks, conf_list, registrations):
+            if not conf:
+                results[wsck] = (False, 'No conference found.')
+            elif reg and registration:
+                results[wsck] = (False,
+                    'You have already registered for this conference.')
+            elif not reg and not registration:
+                results[wsck] = (False,
+                    'You are not registered for this conference.')
+            else:
+                confs[wsck] = conf
+
+        if reg:
+            # take seats first so the Profile only lists conferences
+            # that really have a seat for this user
+            futures = dict((wsck, self._seatTxnAsync(seats.reserveSeat, conf))
+                           for wsck, conf in confs.items())
+            # wait for every reservation, so none is left behind if one
+            # of them fails
+            ndb.Future.wait_all(futures.values())
+            reserved = {}
+            failed = None
+            for wsck, future in futures.items():
+                error = future.get_exception()
+                if error is None:
+                    if future.get_result():
+                        reserved[wsck] = confs[wsck]
+                    else:
+                        results[wsck] = (False,
+                            'There are no seats available.')
+                elif isinstance(error, datastore_errors.Error):
+                    results[wsck] = (False,
+                        'Could not reserve a seat, please try again.')
+                else:
+                    failed = future
+            if failed is not None:
+                # give every seat back before reporting the failure
+                self._releaseSeats(reserved.values())
+                failed.check_success()
+            try:
+                added = self._updateRegistrations(prof.key, reserved.keys())
+            except Exception:
+                # give every seat back before reporting the failure
+                self._releaseSeats(reserved.values())
+                raise
+            # give back seats of conferences registered concurrently
+            self._releaseSeats(conf for wsck, conf in reserved.items()
+                               if wsck not in added)
+            for wsck in reserved:
+                results[wsck] = (True, None) if wsck in added else (False,
+                    'You have already registered for this conference.')
+        else:
+            # drop registrations first so seats are never over-released
+            removed = self._updateRegistrations(
+                prof.key, confs.keys(), reg=False)
+            self._releaseSeats(confs[wsck] for wsck in removed)
+            for wsck in confs:
+                results[wsck] = (True, None) if wsck in removed else (False,
+                    'You are not registered for this conference.')
+
+        return RegistrationResultForms(items=[
+            RegistrationResultForm(websafeConferenceKey=wsck,
+                                   data=results[wsck][0],
+                                   message=results[wsck][1])
+            for wsck in request.websafeConferenceKeys])
+
+
+    @staticmethod
+    def _seatTxnAsync(seat_op, conf):
+        """Run seats.reserveSeat/releaseSeat for conf in its own xg
+        transaction, returning a future."""
+        return ndb.transaction_async(lambda: seat_op(conf), xg=True)
+
+
+    def _releaseSeats(self, confs):
+        """Give back one seat of each conference, in parallel."""
+        futures = [self._seatTxnAsync(seats.releaseSeat, conf)
+                   for conf in confs]
+        ndb.Future.wait_all(futures)
+        for future in futures:
+            future.check_success()
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _updateRegistrations(p_key, wscks, reg=True):
+        """Add (or remove) Registrations of wscks under the user Profile
+        in one batch; return the set of keys that actually changed."""
+        r_keys = [ndb.Key(Registration, wsck, parent=p_key) for wsck in wscks]
+        existing = ndb.get_multi(r_keys + [p_key])
+        prof = existing.pop()
+        if reg:
+            new = [Registration(key=r_key)
+                   for r_key, registration in zip(r_keys, existing)
+                   if not registration]
+            changed = set(registration.key.id() for registration in new)
+            ndb.put_multi(new)
+        else:
+            gone = [registration.key for registration in existing
+                    if registration]
+            changed = set(r_key.id() for r_key in gone)
+            ndb.delete_multi(gone)
+        if changed:
+            ConferenceApi._profileChanged(prof)
+        return changed
+
+
+    @endpoints.method(ConferenceKeysForm, RegistrationResultForms,
+            path='conferences/register',
+            http_method='POST', name='registerForConferences')
+    def registerForConferences(self, request):
+        """Register user for many conferences in one call."""
+        return self._batchRegistration(request)
+
+
+    @endpoints.method(ConferenceKeysForm, RegistrationResultForms,
+            path='conferences/unregister',
+            http_method='POST', name='unregisterFromConferences')
+    def unregisterFromConferences(self, request):
+        """Unregister user from many conferences in one call."""
+        return self._batchRegistration(request, reg=False)
+
+
     @endpoints.method(message_types.VoidMessage,
                       StringMessage,
                       path='filterPlayground',
@@ -626,33 +1343,6 @@ class ConferenceApi(remote.Service):
 # - - - Session - - - - - - - - - - - - - - - - - - - -
 
 
-    def _copySessionToForm(self, sess):
-        """
-        Copy relevant fields from Session to SessionForm.
-
-        :param sess: Session object
-        :return: SessionForm
-        """
-        # Get empty SessionForm
-        sf = SessionForm()
-
-        # Copy fields from Session to SessionForm
-        for field in sf.all_fields():
-            if hasattr(sess, field.name):
-
-                # Convert data into appropriate format
-                if field.name == 'sess_time':
-                    setattr(sf, 'sess_time',
-                            str(getattr(sess, 'sess_time'))[:5])
-                elif field.name == 'sess_date':
-                    setattr(sf, 'sess_date',
-                            str(getattr(sess, 'sess_date'))[:10])
-                else:
-                    setattr(sf, field.name, getattr(sess, field.name))
-        sf.check_initialized()
-        return sf
-
-
     @authentication_required
     def _createSessionObject(self, request):
         """
@@ -661,8 +1351,10 @@ class ConferenceApi(remote.Service):
         :param request: websafeConferenceKey
         :return: SessionForm
         """
-        # Get parent Conference entity
+        # Get parent Conference entity, allocating the Session id (which
+        # only needs the key) meanwhile
         c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        id_future = Session.allocate_ids_async(size=1, parent=c_key)
         conf = c_key.get()
 
         # Check if conf exists
@@ -677,6 +1369,31 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'You must be the organizer of the conference')
 
+        data = self._sessionData(request, conf)
+
+        # Create unique key id
+        s_id = id_future.get_result()[0]
+        s_key = ndb.Key(Session, s_id, parent=c_key)
+        data['key'] = s_key
+
+        # Put data into Session entity
+        sess = Session(**data)
+        self._saveSessions([sess])
+        self._sessionCreatedAsync(sess).get_result()
+
+        return SESSION_SERIALIZER.to_form(sess)
+
+
+    @staticmethod
+    def _sessionData(request, conf):
+        """
+        Check a SessionForm and return the properties of the new Session
+        it describes, less its key
+
+        :param request: SessionForm
+        :param conf: parent Conference object
+        :return: dict of Session properties
+        """
         # Check if user filled required fields
         if not request.sess_time or \
                 not request.sess_date or \
@@ -688,13 +1405,18 @@ class ConferenceApi(remote.Service):
                 for field in request.all_fields()}
 
         # Remove websafeConferenceKey for consistency
-        del data['websafeConferenceKey']
+        data.pop('websafeConferenceKey', None)
 
         # Convert data into appropriate formats
-        data['sess_time'] = datetime.strptime(
-            data['sess_time'][:5], '%H:%M').time()
-        data['sess_date'] = datetime.strptime(
-            data['sess_date'][:10], '%Y-%m-%d').date()
+        try:
+            data['sess_time'] = datetime.strptime(
+                data['sess_time'][:5], '%H:%M').time()
+            data['sess_date'] = datetime.strptime(
+                data['sess_date'][:10], '%Y-%m-%d').date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                'Session time and date must be formatted as HH:MM and '
+                'YYYY-MM-DD')
 
         # Check if session will start during the conference
         session_date = data['sess_date']
@@ -703,23 +1425,272 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException(
                 'Session must held during the conference')
 
-        # Create unique key id
-        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
-        s_key = ndb.Key(Session, s_id, parent=c_key)
-        data['key'] = s_key
+        return data
 
-        # Put data into Session entity
-        Session(**data).put()
 
-        # Set task queue for featured speaker
-        taskqueue.add(
-            params={'websafeConferenceKey': request.websafeConferenceKey},
-            url='/tasks/set_featured_speaker')
+    def _createSessionObjects(self, request):
+        """
+        Create many Session objects of one conference; ids come from one
+        allocate_ids range, sessions are written BULK_CHUNK_SIZE at a time
+        and a single task does the follow-up work for all of them
+
+        :param request: websafeConferenceKey, sessions
+        :return: BulkResultForms, one result per SessionForm
+        """
+        if len(request.sessions) > MAX_BULK_ITEMS:
+            raise endpoints.BadRequestException(
+                'At most %d sessions can be created at once' % MAX_BULK_ITEMS)
+
+        # Get parent Conference entity and check permission once
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'The Parent conference was not found')
+        user = endpoints.get_current_user()
+        user_id = getUserId(user)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'You must be the organizer of the conference')
+
+        # Check every form; invalid ones are reported, not created
+        results = [BulkResultForm(index=i, data=False)
+                   for i in range(len(request.sessions))]
+        valid = []
+        for result, form in zip(results, request.sessions):
+            try:
+                valid.append((result, self._sessionData(form, conf)))
+            except endpoints.BadRequestException as e:
+                result.message = str(e)
+        if not valid:
+            return BulkResultForms(items=results)
+
+        first, _ = Session.allocate_ids(size=len(valid), parent=c_key)
+        sessions = []
+        for s_id, (result, data) in enumerate(valid, first):
+            data['key'] = ndb.Key(Session, s_id, parent=c_key)
+            sessions.append(Session(**data))
+            result.websafeKey = data['key'].urlsafe()
+
+        # Each chunk is one transaction; a failed one is reported for its
+        # sessions only, so every stored session gets its follow-up work
+        stored = []
+        for i in range(0, len(sessions), BULK_CHUNK_SIZE):
+            chunk = sessions[i:i + BULK_CHUNK_SIZE]
+            chunk_results = [result for result, _
+                             in valid[i:i + BULK_CHUNK_SIZE]]
+            try:
+                self._saveSessions(chunk)
+            except Exception as e:
+                logging.warning('Sessions %d-%d of %s not stored: %s',
+                                i, i + len(chunk) - 1, c_key.urlsafe(), e)
+                for result in chunk_results:
+                    result.websafeKey = None
+                    result.message = 'Not stored, please try again.'
+                continue
+            for result in chunk_results:
+                result.data = True
+            stored.extend(chunk)
+        if not stored:
+            return BulkResultForms(items=results)
+
+        # One task indexes them for search and updates the featured
+        # speaker, queued while the caches and speaker index are updated
+        wsck = request.websafeConferenceKey
+        rpc = taskqueue.Task(params={'websafeConferenceKey': wsck,
+            'websafeSessionKeys': json.dumps(
+                [sess.key.urlsafe() for sess in stored])},
+            url='/tasks/sessions_created').add_async()
+        futures = [self._invalidateScheduleAsync(wsck),
+                   speakerindex.addSessionsAsync(stored)]
+        for future in futures:
+            future.get_result()
+        rpc.get_result()
 
-        return self._copySessionToForm(request)
+        return BulkResultForms(items=results)
 
 
-    @endpoints.method(SESSION_GET_REQUEST,
+    @ndb.tasklet
+    def _sessionCreatedAsync(self, sess):
+        """
+        Concurrently drop the cached schedule, update the speaker index
+        and queue the search and featured speaker tasks of a new Session
+
+        :param sess: Session object
+        """
+        wsck = sess.key.parent().urlsafe()
+        yield (self._invalidateScheduleAsync(wsck),
+               speakerindex.addSessionsAsync([sess]),
+               search.enqueueIndexAsync(sess.key.urlsafe()),
+               self._enqueueFeaturedSpeakerAsync(wsck))
+
+
+    @ndb.transactional()
+    def _saveSessions(self, sessions):
+        """
+        Put new Sessions of one conference, add them to its speaker
+        tally and bump its schedule version. All of them live in the
+        conference's entity group.
+
+        :param sessions: list of Session objects
+        """
+        c_key = sessions[0].key.parent()
+        conf_future = c_key.get_async()
+        tally = self._loadSpeakerTally(c_key)
+        for sess in sessions:
+            self._tallySpeakers(tally, sess)
+        conf = conf_future.get_result()
+        conf.scheduleVersion += 1
+        ndb.put_multi(sessions + [tally, conf])
+        versions.publishOnCommit(versions.SCHEDULE, c_key.urlsafe(),
+                                 conf.scheduleVersion)
+
+
+    @staticmethod
+    def _loadSpeakerTally(c_key):
+        """
+        Return the SpeakerTally of a conference, building it from the
+        conference's sessions if it does not exist yet
+
+        :param c_key: Conference key
+        :return: SpeakerTally object
+        """
+        t_key = ndb.Key(SpeakerTally, SPEAKER_TALLY_ID, parent=c_key)
+        tally = t_key.get()
+        if not tally:
+            tally = SpeakerTally(key=t_key, sessionsBySpeaker={})
+            for sess in Session.query(ancestor=c_key):
+                ConferenceApi._tallySpeakers(tally, sess)
+        return tally
+
+
+    @staticmethod
+    def _tallySpeakers(tally, sess):
+        """
+        Count a session towards its speakers; the latest speaker with
+        more than one session becomes the featured speaker
+
+        :param tally: SpeakerTally object
+        :param sess: Session object
+        """
+        for speaker in sess.speakers:
+            names = tally.sessionsBySpeaker.setdefault(speaker, [])
+            names.append(sess.name)
+            if len(names) > 1:
+                tally.featuredSpeaker = speaker
+
+
+    @staticmethod
+    @ndb.tasklet
+    def _enqueueFeaturedSpeakerAsync(wsck):
+        """
+        Add a featured speaker task, merging tasks for the same
+        conference within FEATURED_SPEAKER_WINDOW seconds
+
+        :param wsck: websafeConferenceKey
+        """
+        window = calendar.timegm(datetime.utcnow().timetuple()) \
+            // FEATURED_SPEAKER_WINDOW
+        try:
+            yield taskqueue.Task(
+                name='featured-speaker-%s-%d' % (wsck, window),
+                countdown=FEATURED_SPEAKER_WINDOW,
+                params={'websafeConferenceKey': wsck},
+                url='/tasks/set_featured_speaker').add_async()
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            # a task for this window is already pending
+            pass
+
+
+    @staticmethod
+    def _getCachedSchedule(wsck):
+        """
+        Return the cached schedule of a conference (see _getSchedule)
+        with its version, or None if neither the instance cache nor
+        memcache holds it
+
+        :param wsck: websafeConferenceKey
+        :return: (version, list of Session objects) or None
+        """
+        schedule = SCHEDULE_CACHE.get(wsck)
+        if schedule is not None:
+            return schedule
+
+        cached = memcache.get(MEMCACHE_SCHEDULE_PREFIX + wsck)
+        # schedules cached before they carried a version are misses
+        if not isinstance(cached, tuple):
+            return None
+        version, encoded = cached
+        schedule = (version,
+                    [ndb.model_from_protobuf(entity_pb.EntityProto(pb))
+                     for pb in encoded])
+        SCHEDULE_CACHE.set(wsck, schedule)
+        return schedule
+
+
+    @classmethod
+    def _getVersionedSchedule(cls, wsck):
+        """
+        Return all Session objects of a conference, ordered by date and
+        time, with the schedule version they belong to. Served from the
+        instance cache, then memcache, then the datastore; callers must
+        not modify the returned sessions.
+
+        :param wsck: websafeConferenceKey
+        :return: (version, list of Session objects)
+        """
+        schedule = cls._getCachedSchedule(wsck)
+        if schedule is not None:
+            return schedule
+
+        # The version is read before the sessions, so it is never newer
+        # than them. Sort in memory rather than maintaining a composite
+        # index
+        c_key = ndb.Key(urlsafe=wsck)
+        conf = c_key.get()
+        version = conf.scheduleVersion if conf else 0
+        sessions = Session.query(ancestor=c_key).fetch()
+        sessions.sort(key=lambda sess: (sess.sess_date, sess.sess_time))
+        # A session write commits (publishing its schedule version)
+        # before it drops the cached schedule, so a schedule read before
+        # that write is only cached if no later version is published;
+        # add and the TTL bound what a lost race can leave behind
+        if version >= (versions.get(versions.SCHEDULE, wsck) or 0):
+            memcache.add(MEMCACHE_SCHEDULE_PREFIX + wsck,
+                         (version, [ndb.model_to_protobuf(sess).Encode()
+                                    for sess in sessions]),
+                         time=SCHEDULE_TTL)
+            SCHEDULE_CACHE.set(wsck, (version, sessions))
+        return version, sessions
+
+
+    @classmethod
+    def _getSchedule(cls, wsck):
+        """
+        Return all Session objects of a conference, ordered by date and
+        time (see _getVersionedSchedule)
+
+        :param wsck: websafeConferenceKey
+        :return: list of Session objects
+        """
+        return cls._getVersionedSchedule(wsck)[1]
+
+
+    @staticmethod
+    def _invalidateScheduleAsync(wsck):
+        """
+        Drop the cached schedule of a conference after a Session write
+
+        :param wsck: websafeConferenceKey
+        :return: Future of the memcache delete
+        """
+        SCHEDULE_CACHE.delete(wsck)
+        return ndb.get_context().memcache_delete(
+            MEMCACHE_SCHEDULE_PREFIX + wsck)
+
+
+    @endpoints.method(SESSION_LIST_REQUEST,
                       SessionForms,
                       path='conference/{websafeConferenceKey}/sessions',
                       http_method='GET',
@@ -728,23 +1699,25 @@ class ConferenceApi(remote.Service):
         """
         Return sessions at specific conference (Task 1)
 
-        :param request: websafeConferenceKey
-        :return: sessions at specific conference
+        :param request: websafeConferenceKey, select (Optional),
+            knownVersion (Optional)
+        :return: sessions at specific conference, or only the schedule
+            version if knownVersion is still current
         """
-        # Retrieve Session objects with specific ancestor
-        sessions = Session.query(
-            ancestor=ndb.Key(urlsafe=request.websafeConferenceKey)
-        )\
-            .order(Session.sess_date)\
-            .order(Session.sess_time)
+        fields = self._checkFields(request.select, SESSION_SERIALIZER)
+        wsck = request.websafeConferenceKey
+        if versions.isCurrent(versions.SCHEDULE, wsck, request.knownVersion):
+            return SessionForms(version=request.knownVersion,
+                                notModified=True)
 
-        # Check if session is not empty
-        if not sessions:
-            raise endpoints.NotFoundException(
-                'No sessions were found for the conference')
+        # Retrieve the cached conference schedule; it already holds full
+        # entities, so fields only limits what is serialized
+        version, sessions = self._getVersionedSchedule(wsck)
+        versions.publish(versions.SCHEDULE, wsck, version)
 
         return SessionForms(
-            sessions=[self._copySessionToForm(sess) for sess in sessions])
+            sessions=SESSION_SERIALIZER.to_forms(sessions, fields=fields),
+            version=version)
 
 
     @endpoints.method(SESSION_BY_TYPE_REQUEST,
@@ -760,25 +1733,17 @@ class ConferenceApi(remote.Service):
         :return: specific type of sessions at specific conference
         """
         # Check if user filled required fields
-        if not request.sess_type:
+        if not request.session_type:
             raise endpoints.BadRequestException(
                 'Required field is missing')
 
-        # Retrieve sessions of specific ancestry
-        sessions = Session.query(
-            ancestor=ndb.Key(urlsafe=request.websafeConferenceKey)
-        )\
-            .filter(Session.sess_type == request.sess_type)\
-            .order(Session.sess_date)\
-            .order(Session.sess_time)
-
-        # Check if Session is not empty
-        if not sessions:
-            raise endpoints.NotFoundException(
-                'No session were found')
+        # Filter the cached conference schedule by type
+        sessions = [sess for sess in
+                    self._getSchedule(request.websafeConferenceKey)
+                    if sess.sess_type == request.session_type]
 
         return SessionForms(
-            sessions=[self._copySessionToForm(sess) for sess in sessions])
+            sessions=SESSION_SERIALIZER.to_forms(sessions))
 
 
     @endpoints.method(SpeakerQueryForm,
@@ -788,28 +1753,60 @@ class ConferenceApi(remote.Service):
                       name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
         """
-        Return sessions of specific speaker (Task 1)
+        Return sessions of specific speaker (Task 1), across all
+        conferences or in one, ordered by date and time
 
-        :param request: speaker name
-        :return: all sessions of specific speaker
+        :param request: speaker email, select, websafeConferenceKey,
+            pageSize, pageToken (Optional)
+        :return: one page of sessions of specific speaker
         """
         # Check if user filled required fields
         if not request.speaker:
             raise endpoints.BadRequestException(
                 'Required field is missing')
+        fields = self._checkFields(request.select, SESSION_SERIALIZER)
+        c_key = None
+        if request.websafeConferenceKey:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+
+        # Read the speaker's session keys from the speaker index
+        s_keys = speakerindex.getSessionKeys(request.speaker, c_key)
+        if s_keys is not None:
+            page, next_token = self._pageList(s_keys, request)
+            sessions = [sess for sess in ndb.get_multi(page) if sess]
+        else:
+            sessions, next_token = self._pageList(
+                self._querySpeakerSessions(request.speaker, c_key, fields),
+                request)
 
-        # Retrieve sessions of specific speaker
-        sessions = Session.query(Session.speakers == request.speaker)\
-            .order(Session.sess_date)\
-            .order(Session.sess_time)
+        return SessionForms(
+            sessions=SESSION_SERIALIZER.to_forms(sessions, fields=fields),
+            nextPageToken=next_token)
 
-        # Check if Session is not empty
-        if not sessions:
-            raise endpoints.NotFoundException(
-                'No sessions were found')
 
-        return SessionForms(
-            sessions=[self._copySessionToForm(sess) for sess in sessions])
+    @staticmethod
+    def _querySpeakerSessions(speaker, c_key, fields):
+        """
+        Query the sessions of a speaker without a speaker index
+
+        :param speaker: speaker email
+        :param c_key: Conference key to limit results to (Optional)
+        :param fields: requested response fields (Optional)
+        :return: Session objects ordered by date and time
+        """
+        # Use a projection query if every requested field can be projected
+        projection = None
+        if fields and fields <= frozenset(SESSION_PROJECTION):
+            projection = SESSION_PROJECTION
+
+        sessions = Session.query(Session.speakers == speaker)\
+            .order(Session.sess_date)\
+            .order(Session.sess_time)\
+            .fetch(projection=projection)
+        if c_key:
+            sessions = [sess for sess in sessions
+                        if sess.key.parent() == c_key]
+        return sessions
 
 
     @endpoints.method(SESSION_POST_REQUEST,
@@ -828,7 +1825,107 @@ class ConferenceApi(remote.Service):
         return self._createSessionObject(request)
 
 
-    def _filterSessionByTime(self, wsck, stop_time, start_time=time(0, 0)):
+    @endpoints.method(SESSION_BULK_REQUEST,
+                      BulkResultForms,
+                      path='conference/{websafeConferenceKey}/sessions/create',
+                      http_method='POST',
+                      name='createSessions')
+    def createSessions(self, request):
+        """
+        Create many Session objects of specific conference at once
+
+        :param request: websafeConferenceKey, sessions
+        :return: BulkResultForms, one result per session
+        """
+        return self._createSessionObjects(request)
+
+
+    def _querySessionRange(self, wsck, srange):
+        """
+        Return the sessions of a conference within a SessionRange,
+        ordered by date and time. A cached schedule is filtered in
+        memory; otherwise one bounded query is streamed through the
+        remaining bounds.
+
+        :param wsck: websafeConferenceKey
+        :param srange: SessionRange object
+        :return: list of Session objects
+        """
+        schedule = self._getCachedSchedule(wsck)
+        if schedule is not None:
+            return list(srange.filter(schedule[1]))
+
+        sessions = list(srange.run(ndb.Key(urlsafe=wsck)))
+        sessions.sort(key=lambda sess: (sess.sess_date, sess.sess_time))
+        return sessions
+
+
+    @staticmethod
+    def _parseTime(value, name):
+        """
+        Parse an optional HH:MM request field
+
+        :param value: field value
+        :param name: field name, for the error message
+        :return: time object or None
+        """
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value[:5], '%H:%M').time()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "'%s' must be formatted as HH:MM" % name)
+
+
+    @staticmethod
+    def _parseDate(value, name):
+        """
+        Parse an optional YYYY-MM-DD request field
+
+        :param value: field value
+        :param name: field name, for the error message
+        :return: date object or None
+        """
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value[:10], '%Y-%m-%d').date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "'%s' must be formatted as YYYY-MM-DD" % name)
+
+
+    @endpoints.method(SESSION_RANGE_REQUEST,
+                      SessionForms,
+                      path='conference/{websafeConferenceKey}/sessions/query',
+                      http_method='POST',
+                      name='querySessions')
+    def querySessions(self, request):
+        """
+        Return sessions within a start time window, date window and
+        maximum duration, excluding some session types
+
+        :param request: websafeConferenceKey, startTime, stopTime,
+            startDate, stopDate, maxDuration, excludeTypes (all Optional)
+        :return: SessionForms ordered by date and time
+        """
+        srange = SessionRange(
+            start_time=self._parseTime(request.startTime, 'startTime'),
+            stop_time=self._parseTime(request.stopTime, 'stopTime'),
+            start_date=self._parseDate(request.startDate, 'startDate'),
+            stop_date=self._parseDate(request.stopDate, 'stopDate'),
+            max_duration=request.maxDuration,
+            exclude_types=request.excludeTypes)
+        sessions = self._querySessionRange(
+            request.websafeConferenceKey, srange)
+
+        return SessionForms(
+            sessions=SESSION_SERIALIZER.to_forms(sessions))
+
+
+    def _filterSessionByTime(self, wsck, stop_time, start_time=None,
+                             exclude_types=()):
         """
         Return sessions starting between start_time and stop_time
         (Task 3, one of two additional queries)
@@ -836,18 +1933,15 @@ class ConferenceApi(remote.Service):
         :param wsck: websafeConferenceKey
         :param stop_time: filtering stop time
         :param start_time: filtering start time (Optional)
+        :param exclude_types: session types to leave out (Optional)
         :return: Session objects
         """
-        # Filter query by filtering stop time
-        step_one = Session.query(ancestor=ndb.Key(urlsafe=wsck))\
-            .filter(Session.sess_time < stop_time)\
-            .order(Session.sess_time)\
-            .fetch()
-        # Filter Session objects by filtering start time
-        step_two = [sess for sess in step_one
-                    if sess.sess_time >= start_time]
+        sessions = self._querySessionRange(wsck, SessionRange(
+            start_time=start_time, stop_time=stop_time,
+            exclude_types=exclude_types))
+        sessions.sort(key=lambda sess: sess.sess_time)
 
-        return step_two
+        return sessions
 
 
     def _filterSessionByDuration(self, wsck, duration):
@@ -857,18 +1951,11 @@ class ConferenceApi(remote.Service):
 
         :param wsck: websafeConferenceKey
         :param duration: maximum duration in minutes
-        :return: Session objects
+        :return: Session objects, possibly none
         """
-        # Retrieve Session objects with specific ancestry
-        sessions = Session.query(ancestor=ndb.Key(urlsafe=wsck))\
-            .filter(Session.duration <= duration)\
-            .order(Session.duration)\
-            .fetch()
-
-        # Check if sessions is not empty
-        if not sessions:
-            raise endpoints.BadRequestException(
-                'No sessions were returned')
+        sessions = self._querySessionRange(
+            wsck, SessionRange(max_duration=duration))
+        sessions.sort(key=lambda sess: sess.duration)
 
         return sessions
 
@@ -892,7 +1979,7 @@ class ConferenceApi(remote.Service):
         sessions = self._filterSessionByDuration(wsck, max_duration)
 
         return SessionForms(
-            sessions=[self._copySessionToForm(sess) for sess in sessions])
+            sessions=SESSION_SERIALIZER.to_forms(sessions))
 
 
     @endpoints.method(SESSION_GET_REQUEST,
@@ -914,13 +2001,13 @@ class ConferenceApi(remote.Service):
         # Convert string into time format
         stop_time = datetime.strptime(TIME_END, '%H:%M').time()
 
-        # Retrieve Session objects
+        # Retrieve Session objects, leaving out workshops in the same pass
         sessions = self._filterSessionByTime(
-            request.websafeConferenceKey, stop_time)
+            request.websafeConferenceKey, stop_time,
+            exclude_types=[TYPE_EXCLUDE])
 
         return SessionForms(
-            sessions=[self._copySessionToForm(sess) for sess in sessions
-                      if sess.sess_type != TYPE_EXCLUDE])
+            sessions=SESSION_SERIALIZER.to_forms(sessions))
 
 
 # - - - Wishlist - - - - - - - - - - - - - - - - - - - -
@@ -928,32 +2015,44 @@ class ConferenceApi(remote.Service):
 
     def _sessionWishlist(self, request, add=True):
         """
-        Add or remove session to user's wishlist in Profile object
+        Add or remove session to user's wishlist, stored as
+        WishlistEntry children of the Profile object
 
         :param request: websafeSessionKey
         :param add: add if True, remove if False
         :return: retval boolean
         """
-        retval = False
-        s_key = request.websafeSessionKey  # Get websafeSessionKey
         prof = self._getProfileFromUser()  # Get user Profile object
+        return self._updateWishlist(prof.key, request.websafeSessionKey, add)
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _updateWishlist(p_key, s_key, add):
+        """
+        Add or remove a WishlistEntry in one keyed read and write
+
+        :param p_key: Profile key
+        :param s_key: websafeSessionKey
+        :param add: add if True, remove if False
+        :return: retval boolean
+        """
+        retval = False
+        w_key = ndb.Key(WishlistEntry, s_key, parent=p_key)
+        entry = w_key.get()
 
         # Add websafeSessionKey to user wishlist if add=True
         if add:
-            if s_key in prof.session_wishlist:
-                raise endpoints.ConflictException(
+            if entry:
+                raise ConflictException(
                     'Session has already registered in your wishlist')
-            prof.session_wishlist.append(s_key)
+            WishlistEntry(key=w_key).put()
             retval = True
 
         # Remove from user wishlist if add=False
-        else:
-            if s_key in prof.session_wishlist:
-                prof.session_wishlist.remove(s_key)
-                retval = False
-
-        # Update Profile entity
-        prof.put()
+        elif entry:
+            w_key.delete()
+            retval = True
 
         return BooleanMessage(data=retval)
 
@@ -988,63 +2087,98 @@ class ConferenceApi(remote.Service):
         return self._sessionWishlist(request, add=False)
 
 
-    @endpoints.method(message_types.VoidMessage,
+    @endpoints.method(WISHLIST_GET_REQUEST,
                       SessionForms,
                       path='getSessionsInWishlist',
                       http_method='GET',
                       name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
         """
-        Query for all sessions from user Profile object (Task 2)
+        Query for sessions from user Profile object (Task 2)
 
-        :param request: None
+        :param request: pageSize, pageToken (Optional)
         :return: SessionForms
         """
         prof = self._getProfileFromUser()
-        s_keys = prof.session_wishlist
-        sessions = [ndb.Key(urlsafe=s_key).get() for s_key in s_keys]
+        w_keys, next_token = self._fetchPage(
+            WishlistEntry.query(ancestor=prof.key), request, keys_only=True)
+
+        # Fetch the whole page in one batched, asynchronous RPC
+        futures = ndb.get_multi_async(
+            [ndb.Key(urlsafe=w_key.id()) for w_key in w_keys])
+        sessions = [future.get_result() for future in futures]
 
+        # Skip sessions that have been deleted since they were added
         return SessionForms(
-            sessions=[self._copySessionToForm(sess) for sess in sessions])
+            sessions=SESSION_SERIALIZER.to_forms(
+                [sess for sess in sessions if sess]),
+            nextPageToken=next_token)
 
 
 # - - - Featured Speaker - - - - - - - - - - - - - - - - - - - -
 
 
+    @staticmethod
+    def _featuredSpeakerMessage(tally):
+        """
+        Format the featured speaker announcement of a SpeakerTally
+
+        :param tally: SpeakerTally object
+        :return: String message, empty if there is no featured speaker
+        """
+        feat_speaker = tally.featuredSpeaker
+        if not feat_speaker:
+            return ''
+        feat_sessions = tally.sessionsBySpeaker.get(feat_speaker, [])
+        return FEATURED_TPL % \
+            (feat_speaker, ', '.join(sess for sess in feat_sessions))
+
+
+    @staticmethod
+    def _featuredSpeakerEntry(tally):
+        """
+        Return the cached form of a conference's featured speaker: the
+        tally's size, which only grows, orders concurrent updates
+
+        :param tally: SpeakerTally object
+        :return: (tally size, String message) tuple
+        """
+        size = sum(len(names) for names in tally.sessionsBySpeaker.values())
+        return size, ConferenceApi._featuredSpeakerMessage(tally)
+
+
     @staticmethod
     def _cacheFeaturedSpeaker(wsck):
         """
-        Find featured speaker and add to Memcache entry
+        Find featured speaker of a conference and add to Memcache entry
 
         :param wsck: wsck
         :return: String message
         """
-        # Retrieve Session objects with specific ancestry
-        sessions = Session.query(ancestor=ndb.Key(urlsafe=wsck))\
-            .fetch(projection=[Session.name, Session.speakers])
-
-        # Search for speaker with multiple sessions
-        feat_speaker = ''
-        speaker_container = []
-        for session in sessions:
-            for speaker in session.speakers:
-                if speaker not in speaker_container:
-                    speaker_container.append(speaker)
-                else:
-                    feat_speaker = speaker
-
-        # Get a list of sessions name for featured speaker
-        feat_sessions = [sess.name for sess in sessions
-                         if feat_speaker in sess.speakers]
-
-        # Add message to Memcache if featured speaker exists
-        if feat_speaker:
-            message = FEATURED_TPL % \
-                      (feat_speaker, ', '.join(sess for sess in feat_sessions))
-            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, message)
-        else:
-            message = ''
-            memcache.delete(MEMCACHE_FEATURED_SPEAKER_KEY)
+        # Read the incrementally maintained speaker tally
+        tally = ConferenceApi._loadSpeakerTally(ndb.Key(urlsafe=wsck))
+        entry = ConferenceApi._featuredSpeakerEntry(tally)
+
+        # Cache per conference, unless a concurrent task already cached
+        # a bigger tally; an empty message is cached as well so
+        # conferences without a featured speaker do not keep missing
+        cache.update(MEMCACHE_FEATURED_SPEAKER_PREFIX + wsck,
+                     lambda current: entry
+                     if current is None or current[0] <= entry[0] else None,
+                     FEATURED_SPEAKER_TTL)
+
+        # Keep the legacy site-wide entry for getFeaturedSpeaker, again
+        # never replacing a newer one
+        message = entry[1]
+        if message:
+            now = time.time()
+            cache.update(MEMCACHE_FEATURED_SPEAKER_KEY,
+                         lambda current: (now, message)
+                         if current is None or current[0] <= now else None,
+                         FEATURED_SPEAKER_TTL)
+            FEATURED_SPEAKER_CACHE.invalidate(MEMCACHE_FEATURED_SPEAKER_KEY)
+        FEATURED_SPEAKER_CACHE.invalidate(
+            MEMCACHE_FEATURED_SPEAKER_PREFIX + wsck)
 
         return message
 
@@ -1056,29 +2190,84 @@ class ConferenceApi(remote.Service):
                       name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
         """
-        Return featured speaker with a list of presenting sessions
-        (Task 4)
+        Return featured speaker with a list of presenting sessions of the
+        conference that most recently had one (Task 4)
 
         :param request: None
         :return: String massage
         """
-        return StringMessage(
-            data=memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY) or '')
+        entry = FEATURED_SPEAKER_CACHE.get(MEMCACHE_FEATURED_SPEAKER_KEY)
+        if entry is None:
+            entry = cache.get(MEMCACHE_FEATURED_SPEAKER_KEY) or (0, '')
+            FEATURED_SPEAKER_CACHE.set(MEMCACHE_FEATURED_SPEAKER_KEY, entry)
+        return StringMessage(data=entry[1])
 
 
-# - - - Speaker Entity - - - - - - - - - - - - - - - - - - - -
+    @endpoints.method(CONF_GET_REQUEST,
+                      StringMessage,
+                      path='conference/{websafeConferenceKey}/featuredSpeaker',
+                      http_method='GET',
+                      name='getConferenceFeaturedSpeaker')
+    def getConferenceFeaturedSpeaker(self, request):
+        """
+        Return featured speaker of a conference with a list of
+        presenting sessions
 
+        :param request: websafeConferenceKey
+        :return: String message
+        """
+        key = MEMCACHE_FEATURED_SPEAKER_PREFIX + request.websafeConferenceKey
+        entry = FEATURED_SPEAKER_CACHE.get(key)
+        if entry is None:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+            entry = cache.getOrCompute(
+                key,
+                lambda: self._featuredSpeakerEntry(
+                    self._loadSpeakerTally(c_key)),
+                FEATURED_SPEAKER_TTL)
+            FEATURED_SPEAKER_CACHE.set(key, entry)
+        return StringMessage(data=entry[1])
+
+
+    @endpoints.method(ConferenceKeysForm,
+                      FeaturedSpeakerForms,
+                      path='getFeaturedSpeakers',
+                      http_method='POST',
+                      name='getFeaturedSpeakers')
+    def getFeaturedSpeakers(self, request):
+        """
+        Return featured speakers of many conferences at once
+
+        :param request: websafeConferenceKeys
+        :return: FeaturedSpeakerForms
+        """
+        wscks = request.websafeConferenceKeys
+        entries = cache.getMulti(
+            wscks, key_prefix=MEMCACHE_FEATURED_SPEAKER_PREFIX)
+
+        # Resolve misses from their tallies with a single get_multi
+        missing = [wsck for wsck in set(wscks) if wsck not in entries]
+        if missing:
+            c_keys = [ndb.Key(urlsafe=wsck) for wsck in missing]
+            tallies = ndb.get_multi(
+                [ndb.Key(SpeakerTally, SPEAKER_TALLY_ID, parent=c_key)
+                 for c_key in c_keys])
+            fetched = {}
+            for wsck, c_key, tally in zip(missing, c_keys, tallies):
+                if not tally:
+                    tally = self._loadSpeakerTally(c_key)
+                fetched[wsck] = self._featuredSpeakerEntry(tally)
+            cache.addMulti(fetched, FEATURED_SPEAKER_TTL,
+                           key_prefix=MEMCACHE_FEATURED_SPEAKER_PREFIX)
+            entries.update(fetched)
+
+        return FeaturedSpeakerForms(
+            items=[FeaturedSpeakerForm(websafeConferenceKey=wsck,
+                                       data=entries[wsck][1])
+                   for wsck in wscks])
 
-    def _copySpeakerToForm(self, speaker):
-        # Get empty SessionForm
-        sf = SpeakerForm()
 
-        # Copy fields from Session to SessionForm
-        for field in sf.all_fields():
-            if hasattr(speaker, field.name):
-                setattr(sf, field.name, getattr(speaker, field.name))
-        sf.check_initialized()
-        return sf
+# - - - Speaker Entity - - - - - - - - - - - - - - - - - - - -
 
 
     def _createSpeakerObject(self, request):
@@ -1108,9 +2297,18 @@ class ConferenceApi(remote.Service):
         data['key'] = main_key
 
         # Put to the database
-        Speaker(**data).put()
+        speaker = Speaker(**data)
+        speaker.put()
 
-        return self._copySpeakerToForm(request)
+        # The speaker's bio is searchable through its session
+        search.enqueueIndex(request.websafeSessionKey)
+
+        # Index the session under the speaker's email
+        sess = s_key.get()
+        if sess:
+            speakerindex.addSession(sess, [speaker.mainEmail])
+
+        return SPEAKER_SERIALIZER.to_form(speaker)
 
 
     @endpoints.method(SPEAKER_POST_REQUEST,
@@ -1128,4 +2326,65 @@ class ConferenceApi(remote.Service):
         return self._createSpeakerObject(request)
 
 
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+    def _searchPage(self, kind, request, ancestor=None):
+        """
+        Run a full-text search and load one page of its results
+
+        :param kind: 'Conference' or 'Session'
+        :param request: query, pageSize, pageToken (Optional)
+        :param ancestor: Key limiting results to its descendants (Optional)
+        :return: (entities, nextPageToken), best match first
+        """
+        ranked = search.search(kind, request.query, ancestor)
+        page, next_token = self._pageList(ranked, request)
+        entities = ndb.get_multi([ndb.Key(urlsafe=wsk) for wsk in page])
+
+        # Skip entities deleted since they were indexed
+        return [entity for entity in entities if entity], next_token
+
+
+    @endpoints.method(SEARCH_REQUEST,
+                      ConferenceForms,
+                      path='search/conferences',
+                      http_method='GET',
+                      name='searchConferences')
+    def searchConferences(self, request):
+        """
+        Full-text search over conference names, descriptions, topics and
+        cities
+
+        :param request: query, pageSize, pageToken (Optional)
+        :return: ConferenceForms, best match first
+        """
+        confs, next_token = self._searchPage('Conference', request)
+        return ConferenceForms(
+            items=self._copyConferencesToForms(confs),
+            nextPageToken=next_token)
+
+
+    @endpoints.method(SESSION_SEARCH_REQUEST,
+                      SessionForms,
+                      path='search/sessions',
+                      http_method='GET',
+                      name='searchSessions')
+    def searchSessions(self, request):
+        """
+        Full-text search over session names, highlights and speaker bios
+
+        :param request: query, websafeConferenceKey, pageSize, pageToken
+            (Optional)
+        :return: SessionForms, best match first
+        """
+        ancestor = None
+        if request.websafeConferenceKey:
+            ancestor = ndb.Key(urlsafe=request.websafeConferenceKey)
+        sessions, next_token = self._searchPage('Session', request, ancestor)
+        return SessionForms(
+            sessions=SESSION_SERIALIZER.to_forms(sessions),
+            nextPageToken=next_token)
+
+
 api = endpoints.api_server([ConferenceApi])  # register API
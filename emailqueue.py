@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""emailqueue.py
+
+Udacity conference server-side Python App Engine batched email pipeline
+
+Emails are queued as compact pull tasks (a template id, the recipient
+and conference keys) on the 'email' pull queue. The /crons/send_emails
+worker leases them in batches, loads every conference of a batch with
+one get_multi, renders one message per template and recipient covering
+all of their conferences in the batch, and sends them, deleting each
+message's tasks as soon as it is sent.
+
+Mail goes through a replaceable sender (see setSender()), so tests and
+the dev server can capture messages instead of calling the mail API.
+
+$Id$
+
+"""
+
+import json
+import logging
+import time
+from string import Template
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+EMAIL_QUEUE = 'email'
+LEASE_SECONDS = 60
+# tasks leased per batch; also the taskqueue's delete_tasks limit
+BATCH_SIZE = 100
+# stop leasing new batches after this many seconds of one worker run
+MAX_RUN_SECONDS = 30
+
+CONFERENCE_CREATED = 'conference_created'
+TEMPLATES = {
+    CONFERENCE_CREATED: (
+        'You created a new Conference!',
+        Template('Hi, you have created the following '
+                 'conference(s):\r\n\r\n$conferences'),
+        Template('$name ($city, $startDate - $endDate)'),
+    ),
+}
+
+
+def _sendMail(sender, to, subject, body):
+    mail.send_mail(sender, to, subject, body)
+
+_sender = _sendMail
+
+
+def setSender(sender):
+    """Replace the function sending mail; it is called with the sender
+    and recipient addresses, subject and body. Returns the previous one.
+    """
+    global _sender
+    previous, _sender = _sender, sender
+    return previous
+
+
+def send(to, subject, body):
+    """Send one email from the app's noreply address."""
+    _sender('noreply@%s.appspotmail.com' % (
+        app_identity.get_application_id()), to, subject, body)
+
+
+def emailTask(template, to, conf_keys):
+    """Return a pull task emailing to about conf_keys with template."""
+    return taskqueue.Task(method='PULL', payload=json.dumps({
+        't': template, 'e': to, 'k': [key.urlsafe() for key in conf_keys]}))
+
+
+def enqueueEmail(template, to, conf_keys):
+    """Add an emailTask() to the email queue."""
+    taskqueue.Queue(EMAIL_QUEUE).add(emailTask(template, to, conf_keys))
+
+
+def enqueueEmailAsync(template, to, conf_keys):
+    """Start adding an emailTask() to the email queue; returns the RPC."""
+    return taskqueue.Queue(EMAIL_QUEUE).add_async(
+        emailTask(template, to, conf_keys))
+
+
+def _render(template, confs):
+    subject, body, line = TEMPLATES[template]
+    return subject, body.substitute(conferences='\r\n'.join(
+        line.safe_substitute(
+            name=conf.name, city=conf.city or '',
+            startDate=conf.startDate or '', endDate=conf.endDate or '')
+        for conf in confs))
+
+
+def _sendBatch(queue, tasks):
+    """Send the emails of one batch of leased tasks, deleting each
+    message's tasks as soon as it is sent. Returns the number of tasks
+    deleted; the tasks of a message that failed to send stay leased."""
+    # (template, recipient) -> (conference keys, tasks), in task order
+    messages = {}
+    for task in tasks:
+        payload = json.loads(task.payload)
+        keys, message_tasks = messages.setdefault(
+            (payload['t'], payload['e']), ([], []))
+        keys.extend(ndb.Key(urlsafe=wsck) for wsck in payload['k'])
+        message_tasks.append(task)
+
+    c_keys = list(set(c_key for keys, _ in messages.values()
+                      for c_key in keys))
+    confs = dict(zip(c_keys, ndb.get_multi(c_keys)))
+
+    deleted = 0
+    for (template, to), (keys, message_tasks) in messages.items():
+        # conferences deleted since have nothing to confirm
+        found = [confs[c_key] for c_key in keys if confs[c_key]]
+        if found:
+            subject, body = _render(template, found)
+            try:
+                send(to, subject, body)
+            except Exception:
+                logging.exception('Sending %s email to %s failed',
+                                  template, to)
+                continue
+        queue.delete_tasks(message_tasks)
+        deleted += len(message_tasks)
+    return deleted
+
+
+def drain():
+    """Lease and send queued emails until the queue is empty or the run
+    has taken MAX_RUN_SECONDS. Returns the number of tasks processed.
+
+    Each message's tasks are deleted once it is sent, so a failed send
+    only retries that message, once its lease expires.
+    """
+    queue = taskqueue.Queue(EMAIL_QUEUE)
+    deadline = time.time() + MAX_RUN_SECONDS
+    processed = 0
+    while time.time() < deadline:
+        tasks = queue.lease_tasks(LEASE_SECONDS, BATCH_SIZE)
+        if not tasks:
+            break
+        processed += _sendBatch(queue, tasks)
+    return processed
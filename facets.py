@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+
+"""facets.py
+
+Udacity conference server-side Python App Engine materialized conference
+facets
+
+Every city, month and topic value has a ConferenceFacet entity counting
+its conferences, in total and by city, month, topic and seats bucket,
+so facet counts for no filter or one facet filter are read directly.
+Compact summaries of its conferences, holding just the fields
+queryConferences filters and sorts on, are spread over FACET_SHARDS
+ConferenceFacetShard entities, each its own entity group, so no entity
+grows with every conference and concurrent updates rarely contend.
+Single-facet browse queries read one facet's shards with a single
+get_multi instead of running a query. Facets are refreshed by task
+queue whenever a conference is created or updated, or its seats change
+availability bucket (see seats.py), and are only served once
+rebuildFacets() has backfilled them.
+
+$Id$
+
+"""
+
+import json
+import zlib
+from collections import Counter
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceFacet
+from models import ConferenceFacetShard
+from models import FacetBackfill
+
+import seats
+from planner import QueryPlan
+from planner import planQuery
+
+# queryConferences filter fields served from facets
+FACET_FIELDS = ('city', 'month', 'topics')
+# every conference has exactly one month (0 without a startDate)
+MONTHS = range(13)
+# Conference properties kept in a summary: the queryConferences filter
+# fields and the name results are sorted by
+SUMMARY_PROPERTIES = ('name', 'city', 'month', 'topics', 'maxAttendees')
+# summary shards per facet
+FACET_SHARDS = 8
+# fields getConferenceFacets counts conferences by
+COUNT_FIELDS = FACET_FIELDS + ('seatsBucket',)
+# FacetBackfill id; facets are only served once it exists
+BACKFILL_ID = 'facets'
+
+
+def facetId(field, value):
+    """Return the ConferenceFacet id of a facet value."""
+    return '%s:%s' % (field, value)
+
+
+def facetIds(conf):
+    """Return the ids of every facet conf belongs to."""
+    ids = set()
+    if conf.city:
+        ids.add(facetId('city', conf.city))
+    if conf.month is not None:
+        ids.add(facetId('month', conf.month))
+    for topic in conf.topics:
+        ids.add(facetId('topics', topic))
+    return ids
+
+
+def _shardId(facet_id, wsck):
+    """Return the id of the ConferenceFacetShard holding wsck."""
+    return '%s#%d' % (facet_id,
+                      (zlib.crc32(wsck) & 0xffffffff) % FACET_SHARDS)
+
+
+def _shardKeys(facet_id):
+    """Return the keys of every ConferenceFacetShard of a facet."""
+    return [ndb.Key(ConferenceFacetShard, '%s#%d' % (facet_id, i))
+            for i in range(FACET_SHARDS)]
+
+
+def _summary(conf, seats_available):
+    """Return the compact summary of conf stored in its facets."""
+    summary = {'seatsBucket': seats.seatsBucket(seats_available)}
+    for prop in SUMMARY_PROPERTIES:
+        value = getattr(conf, prop)
+        if value is None or value == []:
+            continue
+        summary[prop] = value
+    return summary
+
+
+def _countedValues(summary):
+    """Return the sorted (field, value) pairs of COUNT_FIELDS a summary
+    is counted under; values are strings, as in ConferenceFacet.counts."""
+    if summary is None:
+        return []
+    values = [('month', '%s' % summary.get('month', 0)),
+              ('seatsBucket', summary['seatsBucket'])]
+    if 'city' in summary:
+        values.append(('city', summary['city']))
+    values.extend(('topics', topic) for topic in set(summary.get('topics', [])))
+    return sorted(values)
+
+
+def _addCounts(counts, summary, delta):
+    """Add delta to the counts of every value summary is counted under."""
+    for field, value in _countedValues(summary):
+        values = counts.setdefault(field, {})
+        count = values.get(value, 0) + delta
+        if count:
+            values[value] = count
+        else:
+            values.pop(value, None)
+
+
+def summaryToConference(wsck, summary):
+    """Return an in-memory (never stored) Conference built from a summary,
+    holding only the summarized properties."""
+    props = dict((prop, summary[prop]) for prop in SUMMARY_PROPERTIES
+                 if prop in summary)
+    return Conference(key=ndb.Key(urlsafe=wsck), **props)
+
+
+def _backfillKey():
+    return ndb.Key(FacetBackfill, BACKFILL_ID)
+
+
+def loadSummaries(facet_ids):
+    """Return a dict of facet id -> wsck -> summary for facet_ids, read
+    with one get_multi; facets without conferences map to None. Returns
+    None until rebuildFacets() has backfilled every facet: until then a
+    facet may only hold the conferences changed since deploying."""
+    facet_ids = list(facet_ids)
+    keys = [_backfillKey()]
+    for facet_id in facet_ids:
+        keys.append(ndb.Key(ConferenceFacet, facet_id))
+        keys.extend(_shardKeys(facet_id))
+    entities = ndb.get_multi(keys)
+    if entities[0] is None:
+        return None
+    entities = entities[1:]
+
+    loaded = {}
+    step = FACET_SHARDS + 1
+    for i, facet_id in enumerate(facet_ids):
+        if entities[i * step] is None:
+            loaded[facet_id] = None
+            continue
+        summaries = {}
+        for shard in entities[i * step + 1:(i + 1) * step]:
+            if shard:
+                summaries.update(shard.summaries)
+        loaded[facet_id] = summaries
+    return loaded
+
+
+def getSummaries(field, value):
+    """Return the wsck -> summary dict of a facet value, or None if it
+    has no conferences or facets are not backfilled yet."""
+    facet_id = facetId(field, value)
+    loaded = loadSummaries([facet_id])
+    return loaded and loaded[facet_id]
+
+
+def summariesInBucket(bucket):
+    """Return the wsck -> summary dict of every conference in a seats
+    bucket, read from the month facets with one get_multi; None until
+    the facets are backfilled."""
+    loaded = loadSummaries(facetId('month', m) for m in MONTHS)
+    if loaded is None:
+        return None
+    return dict((wsck, summary)
+                for summaries in loaded.values() if summaries
+                for wsck, summary in summaries.items()
+                if summary['seatsBucket'] == bucket)
+
+
+def sortedSummaries(summaries):
+    """Return the (wsck, summary) pairs of a facet ordered by name."""
+    return sorted(summaries.items(),
+                  key=lambda item: (item[1].get('name'), item[0]))
+
+
+def refreshTask(wsck, old_ids=()):
+    """Return a task refreshing the facets of a conference; old_ids are
+    the facets it belonged to before an update."""
+    return taskqueue.Task(params={'websafeConferenceKey': wsck,
+                                  'oldFacetIds': json.dumps(sorted(old_ids))},
+                          url='/tasks/refresh_facets')
+
+
+def enqueueRefresh(wsck, old_ids=(), transactional=False):
+    """Add a refreshTask() to the default queue."""
+    refreshTask(wsck, old_ids).add(transactional=transactional)
+
+
+def _applyToFacet(facet_id, wsck, summary):
+    """Store (or, if summary is None, drop) one conference summary and
+    keep the facet's counts in step; run in an xg transaction. The
+    ConferenceFacet is only written when its counts change, e.g. not
+    when a conference is renamed."""
+    s_key = ndb.Key(ConferenceFacetShard, _shardId(facet_id, wsck))
+    f_key = ndb.Key(ConferenceFacet, facet_id)
+    shard, facet = ndb.get_multi([s_key, f_key])
+    shard = shard or ConferenceFacetShard(key=s_key, summaries={})
+    old = shard.summaries.get(wsck)
+    if old == summary:
+        return
+    if summary is None:
+        del shard.summaries[wsck]
+    else:
+        shard.summaries[wsck] = summary
+
+    if _countedValues(old) == _countedValues(summary):
+        shard.put()
+        return
+    facet = facet or ConferenceFacet(key=f_key)
+    facet.count += int(summary is not None) - int(old is not None)
+    facet.counts = facet.counts or {}
+    _addCounts(facet.counts, old, -1)
+    _addCounts(facet.counts, summary, 1)
+    ndb.put_multi([shard, facet])
+
+
+def refreshConference(wsck, old_ids=()):
+    """Bring every facet of a conference up to date."""
+    conf = ndb.Key(urlsafe=wsck).get()
+    new_ids = facetIds(conf) if conf else set()
+    summary = _summary(conf, seats.getSeats(conf)) if conf else None
+
+    # each facet shard is its own entity group; update them in parallel
+    futures = [ndb.transaction_async(
+        lambda facet_id=facet_id: _applyToFacet(
+            facet_id, wsck, summary if facet_id in new_ids else None),
+        xg=True)
+        for facet_id in new_ids.union(old_ids)]
+    ndb.Future.wait_all(futures)
+    for future in futures:
+        future.check_success()
+
+
+def rebuildFacets():
+    """Rebuild every facet from a scan of all conferences; used by the
+    consistency repair cron and to backfill existing conferences."""
+    confs = Conference.query().fetch()
+    seats_available = seats.getSeatsMulti(confs)
+    facets = {}
+    shards = {}
+    for conf in confs:
+        wsck = conf.key.urlsafe()
+        summary = _summary(conf, seats_available[conf.key])
+        for facet_id in facetIds(conf):
+            facet = facets.setdefault(facet_id, ConferenceFacet(
+                id=facet_id, counts={}))
+            facet.count += 1
+            _addCounts(facet.counts, summary, 1)
+            shard_id = _shardId(facet_id, wsck)
+            shard = shards.setdefault(shard_id, ConferenceFacetShard(
+                id=shard_id, summaries={}))
+            shard.summaries[wsck] = summary
+
+    stale = [key for model, built in ((ConferenceFacet, facets),
+                                      (ConferenceFacetShard, shards))
+             for key in model.query().iter(keys_only=True)
+             if key.id() not in built]
+    ndb.put_multi(list(facets.values()) + list(shards.values()))
+    ndb.delete_multi(stale)
+    # facets are served from now on
+    FacetBackfill(key=_backfillKey()).put()
+
+
+def _candidates(filters):
+    """Return the (wsck, summary) pairs a filter set can match, read from
+    the fewest facets possible: the equality filters' facets, or else
+    every month facet. None until the facets are backfilled."""
+    ids = set(facetId(f['field'], f['value']) for f in filters
+              if f['operator'] == '=' and f['field'] in FACET_FIELDS)
+    if not ids:
+        loaded = loadSummaries(facetId('month', m) for m in MONTHS)
+        if loaded is None:
+            return None
+        candidates = {}
+        for summaries in loaded.values():
+            if summaries:
+                candidates.update(summaries)
+        return candidates.items()
+
+    loaded = loadSummaries(ids)
+    if loaded is None:
+        return None
+    loaded = sorted(loaded.values(),
+                    key=lambda summaries: len(summaries or ()))
+    if not all(summaries is not None for summaries in loaded):
+        return []
+    return [(wsck, summary) for wsck, summary in loaded[0].items()
+            if all(wsck in summaries for summaries in loaded[1:])]
+
+
+def _emptyCounts():
+    return dict((field, Counter()) for field in COUNT_FIELDS)
+
+
+def _countSummary(counts, summary):
+    """Count one matching conference's summary into counts."""
+    if 'city' in summary:
+        counts['city'][summary['city']] += 1
+    counts['month'][summary.get('month', 0)] += 1
+    counts['topics'].update(set(summary.get('topics', [])))
+    counts['seatsBucket'][summary['seatsBucket']] += 1
+
+
+def _storedCounts(facet_ids):
+    """Return (total, counts) summed over the stored counts of facets
+    no conference belongs to more than one of, read with one get_multi;
+    None until the facets are backfilled."""
+    counts = _emptyCounts()
+    total = 0
+    entities = ndb.get_multi([_backfillKey()] +
+                             [ndb.Key(ConferenceFacet, facet_id)
+                              for facet_id in facet_ids])
+    if entities[0] is None:
+        return None
+    for facet in entities[1:]:
+        if not facet:
+            continue
+        total += facet.count
+        for field, values in (facet.counts or {}).items():
+            counts[field].update(values)
+    counts['month'] = Counter(dict(
+        (int(month), count) for month, count in counts['month'].items()))
+    return total, counts
+
+
+def countFacets(filters):
+    """Return (total, counts) for the conferences matching filters, where
+    counts maps each facet field, plus 'seatsBucket', to a Counter of
+    value -> number of matching conferences.
+
+    With no filter, or a single equality filter on a facet field, this
+    only reads the stored counts of the month facets or of that facet.
+    Other filter sets go through the summaries of their equality
+    filters' facets, or of every month facet if they have none. Until
+    rebuildFacets() has backfilled the facets, the conferences are
+    counted from a planner query instead.
+    """
+    if not filters:
+        counted = _storedCounts(facetId('month', m) for m in MONTHS)
+    elif len(filters) == 1 and filters[0]['operator'] == '=' and \
+            filters[0]['field'] in FACET_FIELDS:
+        counted = _storedCounts([facetId(filters[0]['field'],
+                                         filters[0]['value'])])
+    else:
+        counted = _summaryCounts(filters)
+    if counted is None:
+        counted = _queryCounts(filters)
+    return counted
+
+
+def _summaryCounts(filters):
+    """Return countFacets() of filters from facet summaries; None until
+    the facets are backfilled."""
+    candidates = _candidates(filters)
+    if candidates is None:
+        return None
+    plan = QueryPlan([], filters)
+    counts = _emptyCounts()
+    total = 0
+    for wsck, summary in candidates:
+        if plan.matches(summaryToConference(wsck, summary)):
+            total += 1
+            _countSummary(counts, summary)
+    return total, counts
+
+
+def _queryCounts(filters):
+    """Return countFacets() of filters from a planner query over the
+    conferences themselves, for use until the facets are backfilled."""
+    plan = planQuery(filters)
+    confs = [conf for conf in plan.query() if plan.matches(conf)]
+    seats_available = seats.getSeatsMulti(confs)
+    counts = _emptyCounts()
+    for conf in confs:
+        _countSummary(counts, _summary(conf, seats_available[conf.key]))
+    return len(confs), counts
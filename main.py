@@ -12,24 +12,30 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
 from conference import ConferenceApi
 
+import cache
+import emailqueue
+import facets
+import search
+from models import Conference
+from models import Session
+
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
-        """Set Announcement in Memcache."""
+        """Rebuild the nearly sold out announcement in Memcache."""
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
-        mail.send_mail(
-            'noreply@%s.appspotmail.com' % (
-                app_identity.sget_application_id()),     # from
+        """Send email confirming Conference creation; only serves tasks
+        queued before emails moved to the email pull queue."""
+        emailqueue.send(
             self.request.get('email'),                  # to
             'You created a new Conference!',            # subj
             'Hi, you have created a following '         # body
@@ -38,6 +44,33 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
+class SendEmailsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send the emails waiting in the email pull queue."""
+        emailqueue.drain()
+        self.response.set_status(204)
+
+
+class ConferencesCreatedHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update facets and search for Conferences created in bulk."""
+        for wsck in json.loads(self.request.get('websafeConferenceKeys')):
+            facets.refreshConference(wsck)
+            search.indexDocument(wsck)
+        self.response.set_status(204)
+
+
+class SessionsCreatedHandler(webapp2.RequestHandler):
+    def post(self):
+        """Index Sessions created in bulk for search and update their
+        Conference's featured speaker."""
+        for wssk in json.loads(self.request.get('websafeSessionKeys')):
+            search.indexDocument(wssk)
+        ConferenceApi._cacheFeaturedSpeaker(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
         wsck = self.request.get('websafeConferenceKey')
@@ -45,8 +78,64 @@ class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class RefreshFacetsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the facets of a created or changed Conference."""
+        facets.refreshConference(
+            self.request.get('websafeConferenceKey'),
+            json.loads(self.request.get('oldFacetIds') or '[]'))
+        self.response.set_status(204)
+
+
+class SeatsBucketChangedHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the facets of a Conference whose seat availability
+        bucket changed."""
+        facets.refreshConference(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class RebuildFacetsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild all Conference facets from scratch."""
+        facets.rebuildFacets()
+        self.response.set_status(204)
+
+
+class IndexDocumentHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the search index entries of a Conference or Session."""
+        search.indexDocument(self.request.get('websafeKey'))
+        self.response.set_status(204)
+
+
+class ReindexSearchHandler(webapp2.RequestHandler):
+    def get(self):
+        """Queue re-indexing of every Conference and Session."""
+        for model in (Conference, Session):
+            for key in model.query().iter(keys_only=True):
+                search.enqueueIndex(key.urlsafe())
+        self.response.set_status(204)
+
+
+class CacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report this instance's local cache hits and misses."""
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(cache.stats()))
+
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/crons/send_emails', SendEmailsHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/conferences_created', ConferencesCreatedHandler),
+    ('/tasks/sessions_created', SessionsCreatedHandler),
+    ('/tasks/refresh_facets', RefreshFacetsHandler),
+    ('/tasks/seats_bucket_changed', SeatsBucketChangedHandler),
+    ('/crons/rebuild_facets', RebuildFacetsHandler),
+    ('/tasks/index_document', IndexDocumentHandler),
+    ('/crons/reindex_search', ReindexSearchHandler),
+    ('/admin/cache_stats', CacheStatsHandler),
 ], debug=True)
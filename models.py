@@ -28,8 +28,24 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    # legacy membership lists, moved into Registration and WishlistEntry
+    # entities the next time the Profile is loaded
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     session_wishlist = ndb.StringProperty(repeated=True)
+    # incremented on every change to the profile or its registrations
+    version = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class Registration(ndb.Model):
+    """Registration -- conference registration; a Profile child keyed
+    by websafeConferenceKey"""
+    pass
+
+
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- wishlisted session; a Profile child keyed by
+    websafeSessionKey"""
+    pass
 
 
 class ProfileMiniForm(messages.Message):
@@ -44,6 +60,8 @@ class ProfileForm(messages.Message):
     mainEmail = messages.StringField(2)
     teeShirtSize = messages.EnumField('TeeShirtSize', 3)
     conferenceKeysToAttend = messages.StringField(4, repeated=True)
+    version = messages.IntegerField(5)
+    notModified = messages.BooleanField(6)
 
 
 class StringMessage(messages.Message):
@@ -68,6 +86,50 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    # incremented on every update of the conference / of its sessions
+    version         = ndb.IntegerProperty(default=0, indexed=False)
+    scheduleVersion = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one shard of a Conference's available seat counter"""
+    seats = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class ConferenceFacet(ndb.Model):
+    """ConferenceFacet -- counts of the conferences sharing one facet
+    value, keyed by facet id (e.g. 'city:London'); counts holds them by
+    city, month, topics and seatsBucket value"""
+    count = ndb.IntegerProperty(default=0)
+    counts = ndb.JsonProperty()
+
+
+class FacetBackfill(ndb.Model):
+    """FacetBackfill -- single entity recording that rebuildFacets() has
+    built the facets of every existing conference"""
+    completed = ndb.DateTimeProperty(auto_now=True)
+
+
+class ConferenceFacetShard(ndb.Model):
+    """ConferenceFacetShard -- summaries of some of a facet's conferences,
+    keyed by facet id and shard number (e.g. 'city:London#3')"""
+    summaries = ndb.JsonProperty(compressed=True)
+
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- indexed terms of one conference or session,
+    keyed by its websafe key; sharded is False for terms indexed before
+    postings were sharded"""
+    kind = ndb.StringProperty()
+    terms = ndb.JsonProperty(compressed=True)
+    sharded = ndb.BooleanProperty(default=False)
+
+
+class SearchTerm(ndb.Model):
+    """SearchTerm -- postings (websafe key -> weight) of some of the
+    documents containing one term, keyed by kind, term and shard number
+    (e.g. 'Session:python#3')"""
+    postings = ndb.JsonProperty(compressed=True)
 
 
 class ConferenceForm(messages.Message):
@@ -84,11 +146,43 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    version         = messages.IntegerField(13)
+    notModified     = messages.BooleanField(14)
+
+
+class QueryPlanForm(messages.Message):
+    """QueryPlanForm -- queryConferences plan (explain mode) outbound form message"""
+    pushedFilters = messages.StringField(1, repeated=True)
+    postFilters = messages.StringField(2, repeated=True)
+    order = messages.StringField(3, repeated=True)
+    projection = messages.BooleanField(4)
+    scanned = messages.IntegerField(5)
+    returned = messages.IntegerField(6)
+
+
+class FacetCountForm(messages.Message):
+    """FacetCountForm -- conferences with one facet value outbound form message"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+
+class FacetForm(messages.Message):
+    """FacetForm -- counts of one facet field outbound form message"""
+    field = messages.StringField(1)
+    counts = messages.MessageField(FacetCountForm, 2, repeated=True)
+
+
+class ConferenceFacetsForm(messages.Message):
+    """ConferenceFacetsForm -- faceted conference counts outbound form message"""
+    total = messages.IntegerField(1)
+    facets = messages.MessageField(FacetForm, 2, repeated=True)
 
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    plan = messages.MessageField(QueryPlanForm, 3)
 
 
 class TeeShirtSize(messages.Enum):
@@ -120,6 +214,10 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    select = messages.StringField(4, repeated=True)
+    explain = messages.BooleanField(5)
 
 
 class Session(ndb.Model):
@@ -134,6 +232,19 @@ class Session(ndb.Model):
     location = ndb.StringProperty()
 
 
+class SpeakerIndex(ndb.Model):
+    """SpeakerIndex -- sessions of one speaker across conferences, keyed
+    by normalized email; sessions holds [sort key, websafeSessionKey]
+    pairs in date and time order"""
+    sessions = ndb.JsonProperty(compressed=True)
+
+
+class SpeakerTally(ndb.Model):
+    """SpeakerTally -- per-conference session names by speaker"""
+    sessionsBySpeaker = ndb.JsonProperty()
+    featuredSpeaker = ndb.StringProperty(indexed=False)
+
+
 class SessionForm(messages.Message):
     """SessionForm -- Session query outbound form message"""
     name = messages.StringField(1, required=True)
@@ -149,6 +260,9 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple SessionForms outbound form message"""
     sessions = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    version = messages.IntegerField(3)
+    notModified = messages.BooleanField(4)
 
 
 class SessionByTypeQueryForm(messages.Message):
@@ -161,9 +275,64 @@ class SessionByDurationQueryForm(messages.Message):
     max_duration = messages.IntegerField(1, required=True)
 
 
+class SessionRangeQueryForm(messages.Message):
+    """SessionRangeQueryForm -- session range query inbound form message"""
+    startTime = messages.StringField(1)  # HH:MM, inclusive
+    stopTime = messages.StringField(2)  # HH:MM, exclusive
+    startDate = messages.StringField(3)  # YYYY-MM-DD
+    stopDate = messages.StringField(4)  # YYYY-MM-DD
+    maxDuration = messages.IntegerField(5)
+    excludeTypes = messages.StringField(6, repeated=True)
+
+
+class ConferenceKeysForm(messages.Message):
+    """ConferenceKeysForm -- multiple websafeConferenceKey inbound form message"""
+    websafeConferenceKeys = messages.StringField(1, repeated=True)
+
+
+class FeaturedSpeakerForm(messages.Message):
+    """FeaturedSpeakerForm -- featured speaker of one conference outbound form message"""
+    websafeConferenceKey = messages.StringField(1, required=True)
+    data = messages.StringField(2)
+
+
+class FeaturedSpeakerForms(messages.Message):
+    """FeaturedSpeakerForms -- multiple FeaturedSpeakerForm outbound form message"""
+    items = messages.MessageField(FeaturedSpeakerForm, 1, repeated=True)
+
+
+class RegistrationResultForm(messages.Message):
+    """RegistrationResultForm -- registration result of one conference outbound form message"""
+    websafeConferenceKey = messages.StringField(1, required=True)
+    data = messages.BooleanField(2)
+    message = messages.StringField(3)
+
+
+class RegistrationResultForms(messages.Message):
+    """RegistrationResultForms -- multiple RegistrationResultForm outbound form message"""
+    items = messages.MessageField(RegistrationResultForm, 1, repeated=True)
+
+
+class BulkResultForm(messages.Message):
+    """BulkResultForm -- result of one item of a bulk create outbound form message"""
+    index = messages.IntegerField(1, required=True)
+    websafeKey = messages.StringField(2)
+    data = messages.BooleanField(3)
+    message = messages.StringField(4)
+
+
+class BulkResultForms(messages.Message):
+    """BulkResultForms -- multiple BulkResultForm outbound form message"""
+    items = messages.MessageField(BulkResultForm, 1, repeated=True)
+
+
 class SpeakerQueryForm(messages.Message):
     """SpeakerQueryForm -- SpeakerQueryForm query inbound form message"""
     speaker = messages.StringField(1, required=True)
+    select = messages.StringField(2, repeated=True)
+    websafeConferenceKey = messages.StringField(3)
+    pageSize = messages.IntegerField(4)
+    pageToken = messages.StringField(5)
 
 
 class Speaker(ndb.Model):
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""planner.py
+
+Udacity conference server-side Python App Engine query planner for
+queryConferences
+
+The planner pushes the single most selective indexable filter (an
+equality, or every inequality on one property) to the datastore, where
+the (property, name) composite indexes in index.yaml serve it. All other
+filters, including inequalities on further properties and '!=', are
+applied in memory to the streamed results.
+
+$Id$
+
+"""
+
+import operator
+
+from google.appengine.ext import ndb
+
+from models import Conference
+
+# Estimated selectivity of an equality filter per property, most
+# selective first: cities and topics split the catalog far more finely
+# than months or attendee caps.
+EQUALITY_RANK = {'city': 0, 'topics': 1, 'month': 2, 'maxAttendees': 3}
+# Properties with a (property, name) composite index
+INDEXED_FIELDS = frozenset(EQUALITY_RANK)
+# '!=' would be split into two datastore queries; always filter in memory
+PUSHABLE_OPERATORS = frozenset(['=', '<', '<=', '>', '>='])
+# Bound on the entities one request may scan for post-filtered queries
+MAX_SCANNED = 1000
+
+PREDICATES = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def _describe(filtr):
+    return '%s %s %s' % (filtr['field'], filtr['operator'], filtr['value'])
+
+
+def _matches(entity, filtr):
+    """Evaluate a filter like the datastore does: a repeated property
+    matches if any of its values does; missing values never match."""
+    value = getattr(entity, filtr['field'])
+    values = value if isinstance(value, list) else [value]
+    predicate = PREDICATES[filtr['operator']]
+    return any(predicate(v, filtr['value']) for v in values if v is not None)
+
+
+class QueryPlan(object):
+    """QueryPlan -- datastore filters plus in-memory post-filters"""
+
+    def __init__(self, pushed, post_filters):
+        self.pushed = pushed
+        self.post_filters = post_filters
+        self.scanned = 0
+        self.returned = 0
+
+    @property
+    def equality_field(self):
+        """The property of a pushed equality filter, if any."""
+        if self.pushed and self.pushed[0]['operator'] == '=':
+            return self.pushed[0]['field']
+        return None
+
+    @property
+    def order(self):
+        """Sort orders; an inequality property must be sorted on first."""
+        if self.pushed and self.pushed[0]['operator'] != '=':
+            return [self.pushed[0]['field'], 'name']
+        return ['name']
+
+    def query(self):
+        """Return the ndb query for the pushed filters."""
+        q = Conference.query()
+        for filtr in self.pushed:
+            q = q.filter(ndb.query.FilterNode(
+                filtr['field'], filtr['operator'], filtr['value']))
+        for prop in self.order:
+            q = q.order(ndb.GenericProperty(prop))
+        return q
+
+    def describe(self):
+        """Return (pushed filters, post-filters, order) as strings."""
+        return ([_describe(filtr) for filtr in self.pushed],
+                [_describe(filtr) for filtr in self.post_filters],
+                self.order)
+
+    def matches(self, entity):
+        return all(_matches(entity, filtr) for filtr in self.post_filters)
+
+    def fetchPage(self, page_size, start_cursor=None, **options):
+        """Return (results, next_cursor, more) like Query.fetch_page().
+
+        Without post-filters this is a plain fetch_page(). Otherwise the
+        query is streamed and filtered until the page is full or
+        MAX_SCANNED entities were read, so a page may come back short
+        with a cursor to continue from.
+        """
+        q = self.query()
+        if not self.post_filters:
+            results, cursor, more = q.fetch_page(
+                page_size, start_cursor=start_cursor, **options)
+            self.scanned += len(results)
+            self.returned += len(results)
+            return results, cursor, more
+
+        results = []
+        it = q.iter(start_cursor=start_cursor, produce_cursors=True,
+                    batch_size=page_size, **options)
+        for entity in it:
+            self.scanned += 1
+            if self.matches(entity):
+                results.append(entity)
+            if len(results) >= page_size or self.scanned >= MAX_SCANNED:
+                break
+        else:
+            return self._done(results, None, False)
+        return self._done(results, it.cursor_after(), it.probably_has_next())
+
+    def _done(self, results, cursor, more):
+        self.returned += len(results)
+        return results, cursor, more
+
+
+def _rank(group):
+    """Sort key of a candidate filter group; lower is more selective."""
+    filtr = group[0]
+    if filtr['operator'] == '=':
+        return (0, EQUALITY_RANK[filtr['field']])
+    # a bounded range beats an open-ended one
+    return (1, -len(group), EQUALITY_RANK[filtr['field']])
+
+
+def planQuery(filters):
+    """Return a QueryPlan for parsed filters (dicts of field, operator
+    and value)."""
+    candidates = []
+    ranges = {}
+    for filtr in filters:
+        if (filtr['field'] not in INDEXED_FIELDS or
+                filtr['operator'] not in PUSHABLE_OPERATORS):
+            continue
+        if filtr['operator'] == '=':
+            candidates.append([filtr])
+        else:
+            ranges.setdefault(filtr['field'], []).append(filtr)
+    candidates.extend(ranges.values())
+
+    if not candidates:
+        return QueryPlan([], list(filters))
+    pushed = min(candidates, key=_rank)
+    return QueryPlan(pushed, [filtr for filtr in filters
+                              if not any(filtr is p for p in pushed)])
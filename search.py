@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+"""search.py
+
+Udacity conference server-side Python App Engine full-text search
+
+Conferences (name, description, topics, city) and sessions (name,
+highlights and their speakers' bios) are tokenized into a datastore
+inverted index: the weighted postings of the documents containing a
+(kind, term) are spread over TERM_SHARDS SearchTerm entities, each its
+own entity group, so common terms neither outgrow an entity nor
+serialize every index update. A SearchDocument per document records
+its terms so re-indexing only touches changed terms. Documents are
+re-indexed by task queue after every change.
+
+$Id$
+
+"""
+
+import math
+import re
+import zlib
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SearchDocument
+from models import SearchTerm
+from models import Speaker
+
+# per-field term weights; a name match outranks a body match
+CONFERENCE_FIELDS = {'name': 3, 'topics': 2, 'city': 2, 'description': 1}
+SESSION_FIELDS = {'name': 3, 'highlights': 1}
+SPEAKER_FIELDS = {'bio': 1}
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+STOPWORDS = frozenset("""a an and are as at be by for from has in is it its
+    of on or that the this to was were will with""".split())
+# longest query accepted, in terms
+MAX_QUERY_TERMS = 10
+# posting shards per term
+TERM_SHARDS = 16
+
+
+def tokenize(text):
+    """Return the index terms of a text, in order."""
+    return [token for token in TOKEN_RE.findall(text.lower())
+            if len(token) > 1 and token not in STOPWORDS]
+
+
+def _addTerms(terms, entity, fields):
+    for field, weight in fields.items():
+        value = getattr(entity, field)
+        for text in value if isinstance(value, list) else [value]:
+            for term in tokenize(text or ''):
+                terms[term] = terms.get(term, 0) + weight
+
+
+def _documentTerms(key):
+    """Return the term -> weight dict of a conference or session, or None
+    if it no longer exists."""
+    entity = key.get()
+    if not entity:
+        return None
+    terms = {}
+    if key.kind() == 'Conference':
+        _addTerms(terms, entity, CONFERENCE_FIELDS)
+    else:
+        _addTerms(terms, entity, SESSION_FIELDS)
+        for speaker in Speaker.query(ancestor=key):
+            _addTerms(terms, speaker, SPEAKER_FIELDS)
+    return terms
+
+
+def _termKey(kind, term, wsk):
+    """Return the key of the SearchTerm shard holding wsk's posting."""
+    return ndb.Key(SearchTerm, '%s:%s#%d' % (
+        kind, term, (zlib.crc32(wsk) & 0xffffffff) % TERM_SHARDS))
+
+
+def _termKeys(kind, term):
+    """Return the keys of every SearchTerm shard of a term."""
+    return [ndb.Key(SearchTerm, '%s:%s#%d' % (kind, term, i))
+            for i in range(TERM_SHARDS)]
+
+
+def _updatePosting(key, wsk, weight):
+    """Set (or, if weight is None, drop) one posting; run in a
+    transaction."""
+    entry = key.get() or SearchTerm(key=key, postings={})
+    if weight is None:
+        if wsk not in entry.postings:
+            return
+        del entry.postings[wsk]
+    else:
+        entry.postings[wsk] = weight
+    if entry.postings:
+        entry.put()
+    else:
+        key.delete()
+
+
+def indexTask(wsk):
+    """Return a task re-indexing the conference or session wsk."""
+    return taskqueue.Task(params={'websafeKey': wsk},
+                          url='/tasks/index_document')
+
+
+def enqueueIndex(wsk, transactional=False):
+    """Add an indexTask() to the default queue."""
+    indexTask(wsk).add(transactional=transactional)
+
+
+@ndb.tasklet
+def enqueueIndexAsync(wsk):
+    """Asynchronous enqueueIndex()."""
+    yield indexTask(wsk).add_async()
+
+
+def indexDocument(wsk):
+    """Bring the index entries of the conference or session wsk up to
+    date, removing them if it was deleted."""
+    key = ndb.Key(urlsafe=wsk)
+    doc_key = ndb.Key(SearchDocument, wsk)
+    doc = doc_key.get()
+    # terms indexed before postings were sharded are written afresh
+    old_terms = doc.terms if doc and doc.sharded else {}
+    new_terms = _documentTerms(key) or {}
+
+    # each term is its own entity group; update them in parallel
+    changed = [term for term in set(old_terms).union(new_terms)
+               if old_terms.get(term) != new_terms.get(term)]
+    futures = [ndb.transaction_async(
+        lambda term=term: _updatePosting(
+            _termKey(key.kind(), term, wsk), wsk, new_terms.get(term)))
+        for term in changed]
+    ndb.Future.wait_all(futures)
+    for future in futures:
+        future.check_success()
+
+    if new_terms:
+        SearchDocument(key=doc_key, kind=key.kind(), terms=new_terms,
+                       sharded=True).put()
+    elif doc:
+        doc_key.delete()
+
+
+def search(kind, query, ancestor=None):
+    """Return the websafe keys of kind documents matching any query term,
+    best first; ancestor, if given, limits results to its descendants.
+
+    A document scores the sum of its term weights, each scaled down by
+    how many documents contain the term so rare terms count for more.
+    """
+    terms = tokenize(query)[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+    terms = sorted(set(terms))
+    shards = ndb.get_multi([key for term in terms
+                            for key in _termKeys(kind, term)])
+    scores = {}
+    for i in range(len(terms)):
+        postings = {}
+        for entry in shards[i * TERM_SHARDS:(i + 1) * TERM_SHARDS]:
+            if entry:
+                postings.update(entry.postings)
+        if not postings:
+            continue
+        idf = 1.0 / math.log(1 + len(postings), 2)
+        for wsk, weight in postings.items():
+            scores[wsk] = scores.get(wsk, 0) + weight * idf
+
+    if ancestor:
+        prefix = ancestor.flat()
+        scores = dict((wsk, score) for wsk, score in scores.items()
+                      if ndb.Key(urlsafe=wsk).flat()[:len(prefix)] == prefix)
+    return sorted(scores, key=lambda wsk: (-scores[wsk], wsk))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Udacity conference server-side Python App Engine sharded seat counters
+
+Conference.seatsAvailable is split over NUM_SHARDS SeatShard entities,
+each in its own entity group, so concurrent registrations for the same
+conference rarely contend. No shard ever goes below zero, so the total
+can never exceed the seats the counters were initialized with.
+
+$Id$
+
+"""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import announcement
+
+from models import SeatShard
+
+# registration transactions touch the Profile plus at most every shard,
+# which must stay within the 25 entity group limit of xg transactions
+NUM_SHARDS = 10
+MEMCACHE_SEATS_PREFIX = 'SEATS:'
+# seconds a cached seat total is kept; a total summed while a seat
+# change committed is wrong until then
+SEATS_TTL = 60
+# conferences with at most this many seats left are nearly sold out
+NEARLY_SOLD_OUT_SEATS = 5
+SOLD_OUT = 'SOLD_OUT'
+NEARLY_SOLD_OUT = 'NEARLY_SOLD_OUT'
+AVAILABLE = 'AVAILABLE'
+
+
+def _shardKeys(conf_key):
+    """Return the SeatShard keys of a conference."""
+    wsck = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s:%d' % (wsck, i))
+            for i in range(NUM_SHARDS)]
+
+
+def _buildShards(conf_key, seats):
+    """Return new SeatShard entities spreading seats over every shard."""
+    seats = max(seats or 0, 0)
+    base, extra = divmod(seats, NUM_SHARDS)
+    return [SeatShard(key=key, seats=base + (1 if i < extra else 0))
+            for i, key in enumerate(_shardKeys(conf_key))]
+
+
+def seatsBucket(seats):
+    """Return the availability bucket of a seat count."""
+    if seats <= 0:
+        return SOLD_OUT
+    if seats <= NEARLY_SOLD_OUT_SEATS:
+        return NEARLY_SOLD_OUT
+    return AVAILABLE
+
+
+def _bucketChanged(conf, seats):
+    """Report conf moving to the availability bucket of seats: the
+    announcement set is updated at once, facets by task."""
+    announcement.updateConference(conf.key.urlsafe(), conf.name,
+                                  seatsBucket(seats) == NEARLY_SOLD_OUT)
+    taskqueue.add(params={'websafeConferenceKey': conf.key.urlsafe()},
+                  url='/tasks/seats_bucket_changed')
+
+
+def _updateCached(conf, delta):
+    """Apply delta to the cached seat total once the change commits, and
+    report a change of availability bucket."""
+    cache_key = MEMCACHE_SEATS_PREFIX + conf.key.urlsafe()
+
+    def callback():
+        if delta < 0:
+            seats = memcache.decr(cache_key, -delta)
+        else:
+            seats = memcache.incr(cache_key, delta)
+        if seats is None:
+            # not cached: sum the shards, which include this change
+            seats = getSeats(conf)
+        if seatsBucket(seats) != seatsBucket(seats - delta):
+            _bucketChanged(conf, seats)
+    ndb.get_context().call_on_commit(callback)
+
+
+@ndb.tasklet
+def initSeatsAsync(conf_key, seats):
+    """Create the seat shards of a new conference; the shards and the
+    cached total are written concurrently."""
+    yield (ndb.put_multi_async(_buildShards(conf_key, seats)),
+           ndb.get_context().memcache_set(
+               MEMCACHE_SEATS_PREFIX + conf_key.urlsafe(), max(seats, 0),
+               time=SEATS_TTL))
+
+
+def getSeatsMulti(confs, fallback=True):
+    """Return a dict of conference key -> seats available for confs.
+
+    Totals are served from memcache; misses are summed from their shards
+    with a single get_multi and cached for SEATS_TTL seconds, unless a
+    total was cached meanwhile. Conferences created before seat
+    shards existed fall back to Conference.seatsAvailable; with
+    fallback=False they get None instead, for confs built from their
+    key alone.
+    """
+    return getSeatsMultiAsync(confs, fallback).get_result()
+
+
+@ndb.tasklet
+def getSeatsMultiAsync(confs, fallback=True):
+    """Asynchronous getSeatsMulti()."""
+    ctx = ndb.get_context()
+    by_wsck = dict((conf.key.urlsafe(), conf) for conf in confs)
+    wscks = list(by_wsck)
+    # memcache gets issued together are batched into one RPC
+    cached = yield [ctx.memcache_get(MEMCACHE_SEATS_PREFIX + wsck)
+                    for wsck in wscks]
+    totals = dict((wsck, total) for wsck, total in zip(wscks, cached)
+                  if total is not None)
+
+    missing = [wsck for wsck in wscks if wsck not in totals]
+    if missing:
+        shards = yield ndb.get_multi_async(
+            [key for wsck in missing
+             for key in _shardKeys(by_wsck[wsck].key)])
+        fetched = {}
+        for i, wsck in enumerate(missing):
+            conf_shards = shards[i * NUM_SHARDS:(i + 1) * NUM_SHARDS]
+            if any(conf_shards):
+                fetched[wsck] = sum(shard.seats for shard in conf_shards
+                                    if shard)
+            elif fallback:
+                fetched[wsck] = by_wsck[wsck].seatsAvailable or 0
+            else:
+                fetched[wsck] = None
+        yield [ctx.memcache_add(MEMCACHE_SEATS_PREFIX + wsck, total,
+                                time=SEATS_TTL)
+               for wsck, total in fetched.items() if total is not None]
+        totals.update(fetched)
+
+    raise ndb.Return(dict((by_wsck[wsck].key, totals[wsck])
+                          for wsck in by_wsck))
+
+
+def getSeats(conf):
+    """Return the number of seats available for conf."""
+    return getSeatsMulti([conf])[conf.key]
+
+
+def _loadShards(conf):
+    """Return (shards, built): every SeatShard of conf, read with one
+    get_multi in the caller's xg transaction, so concurrent callers
+    conflict instead of overwriting each other's shards.
+
+    Only a conference without any shard predates them: its shards are
+    built from Conference.seatsAvailable, built is True and they must
+    all be put. A shard missing from a partial set holds no seats.
+    """
+    keys = _shardKeys(conf.key)
+    shards = ndb.get_multi(keys)
+    if not any(shards):
+        return _buildShards(conf.key, conf.seatsAvailable), True
+    return [shard or SeatShard(key=key, seats=0)
+            for key, shard in zip(keys, shards)], False
+
+
+def _putShards(shards, built, shard):
+    """Store shard after a change, or every shard if they were built."""
+    if built:
+        ndb.put_multi(shards)
+    else:
+        shard.put()
+
+
+def reserveSeat(conf):
+    """Take one seat of conf from a random shard; False if sold out.
+
+    Must run inside an xg transaction. Shards are tried in random order,
+    so only a nearly sold out conference reads more than one of them.
+    """
+    keys = _shardKeys(conf.key)
+    random.shuffle(keys)
+    for key in keys:
+        shard = key.get()
+        if shard is None:
+            # no shards yet, or a partial set: read them all
+            shards, built = _loadShards(conf)
+            random.shuffle(shards)
+            for shard in shards:
+                if shard.seats > 0:
+                    shard.seats -= 1
+                    _putShards(shards, built, shard)
+                    _updateCached(conf, -1)
+                    return True
+            return False
+        if shard.seats > 0:
+            shard.seats -= 1
+            shard.put()
+            _updateCached(conf, -1)
+            return True
+    return False
+
+
+def releaseSeat(conf):
+    """Give one seat of conf back to a random shard.
+
+    Must run inside an xg transaction.
+    """
+    key = random.choice(_shardKeys(conf.key))
+    shard = key.get()
+    if shard is None:
+        # no shards yet, or a partial set: read them all
+        shards, built = _loadShards(conf)
+        shard = shards[0]
+        shard.seats += 1
+        _putShards(shards, built, shard)
+    else:
+        shard.seats += 1
+        shard.put()
+    _updateCached(conf, 1)
+
+
+def adjustSeats(conf, delta):
+    """Add (or, if negative, remove) delta seats of conf.
+
+    Used when maxAttendees changes; seats already taken are never
+    removed, so the result may be less than asked for. Returns the
+    number of seats actually added or removed.
+    """
+    if not delta:
+        return 0
+
+    @ndb.transactional(xg=True)
+    def txn():
+        shards, _ = _loadShards(conf)
+        if delta > 0:
+            random.choice(shards).seats += delta
+            changed = delta
+        else:
+            wanted = -delta
+            for shard in shards:
+                taken = min(shard.seats, wanted)
+                shard.seats -= taken
+                wanted -= taken
+            changed = delta + wanted
+        ndb.put_multi(shards)
+        return changed
+
+    old_seats = getSeats(conf)
+    changed = txn()
+    memcache.delete(MEMCACHE_SEATS_PREFIX + conf.key.urlsafe())
+    if changed:
+        seats = getSeats(conf)
+        if seatsBucket(seats) != seatsBucket(old_seats):
+            _bucketChanged(conf, seats)
+    return changed
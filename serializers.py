@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""serializers.py
+
+Udacity conference server-side Python App Engine entity to ProtoRPC
+message serializers
+
+Each FormSerializer works out once, per model/message pair, which
+fields to copy and how to convert them, so serializing an entity is a
+plain loop over precomputed copiers instead of hasattr/getattr/setattr
+reflection over every message field.
+
+$Id$
+
+"""
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+from models import Speaker
+from models import SpeakerForm
+from models import TeeShirtSize
+
+
+class FormSerializer(object):
+    """FormSerializer -- copies ndb model properties onto a message"""
+
+    def __init__(self, model_class, form_class, converters=None,
+                 computed=None, exclude=()):
+        """Precompute the copiers of model_class -> form_class.
+
+        converters maps a field name to a function applied to the
+        property value; computed maps a field name to a function of the
+        entity, for fields that are not model properties; exclude names
+        fields that callers always supply as extras.
+        """
+        converters = converters or {}
+        computed = computed or {}
+        self.form_class = form_class
+        self.field_names = frozenset(
+            field.name for field in form_class.all_fields())
+        self._required = frozenset(
+            field.name for field in form_class.all_fields() if field.required)
+        self._copiers = []
+        self._computed = []
+        for field in form_class.all_fields():
+            name = field.name
+            if name in exclude:
+                continue
+            if name in computed:
+                self._computed.append((name, computed[name]))
+            elif name in model_class._properties:
+                self._copiers.append((name, converters.get(name)))
+
+    def _select(self, fields):
+        """Return the (copiers, computed) lists limited to fields plus the
+        message's required fields; all of them if fields is None."""
+        if fields is None:
+            return self._copiers, self._computed
+        wanted = self._required.union(fields)
+        return ([copier for copier in self._copiers if copier[0] in wanted],
+                [compute for compute in self._computed
+                 if compute[0] in wanted])
+
+    def _toForm(self, entity, copiers, computed, extras):
+        form = self.form_class()
+        for name, convert in copiers:
+            value = getattr(entity, name)
+            if convert is not None:
+                value = convert(value)
+            setattr(form, name, value)
+        for name, compute in computed:
+            setattr(form, name, compute(entity))
+        for name, value in extras.iteritems():
+            setattr(form, name, value)
+        form.check_initialized()
+        return form
+
+    def to_form(self, entity, fields=None, **extras):
+        """Return a message for entity, copying only fields (and required
+        fields) if given; extras are set on it verbatim."""
+        copiers, computed = self._select(fields)
+        return self._toForm(entity, copiers, computed, extras)
+
+    def to_forms(self, entities, extras=None, fields=None):
+        """Return a message per entity; extras, if given, is a list of
+        per-entity dicts of extra field values parallel to entities."""
+        copiers, computed = self._select(fields)
+        if extras is None:
+            return [self._toForm(entity, copiers, computed, {})
+                    for entity in entities]
+        return [self._toForm(entity, copiers, computed, entity_extras)
+                for entity, entity_extras in zip(entities, extras)]
+
+
+CONFERENCE_SERIALIZER = FormSerializer(
+    Conference, ConferenceForm,
+    # convert Date to date string; just copy others
+    converters={'startDate': str, 'endDate': str},
+    computed={'websafeKey': lambda conf: conf.key.urlsafe()},
+    exclude=('seatsAvailable',))
+
+PROFILE_SERIALIZER = FormSerializer(
+    Profile, ProfileForm,
+    # convert t-shirt string to Enum
+    converters={'teeShirtSize': lambda size: getattr(TeeShirtSize, size)},
+    exclude=('conferenceKeysToAttend',))
+
+SESSION_SERIALIZER = FormSerializer(
+    Session, SessionForm,
+    converters={'sess_time': lambda value: str(value)[:5],
+                'sess_date': lambda value: str(value)[:10]})
+
+SPEAKER_SERIALIZER = FormSerializer(Speaker, SpeakerForm)
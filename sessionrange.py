@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""sessionrange.py
+
+Udacity conference server-side Python App Engine session range queries
+
+A SessionRange combines a start time window, a date window, a maximum
+duration and excluded session types. The datastore allows inequality
+filters on only one property per query, so the range pushes the single
+most selective of them into an ancestor query and streams the results
+through a generator applying the rest. sess_time is stored as a
+datetime on a fixed date, so time-of-day windows are plain index range
+scans without a precomputed minute-of-day property.
+
+$Id$
+
+"""
+
+from models import Session
+
+# Inequality properties by estimated selectivity, most selective first:
+# a date window usually keeps one or two days of a conference, a time
+# window a few hours of each day, and most sessions fit any duration cap.
+# Each has an (ancestor, property) index in index.yaml.
+RANGE_RANK = ('sess_date', 'sess_time', 'duration')
+
+
+class SessionRange(object):
+    """SessionRange -- bounds on a conference's sessions; every bound is
+    optional. Times are [start_time, stop_time), dates and duration
+    inclusive."""
+
+    def __init__(self, start_time=None, stop_time=None, start_date=None,
+                 stop_date=None, max_duration=None, exclude_types=()):
+        self.bounds = {
+            'sess_time': (start_time, stop_time),
+            'sess_date': (start_date, stop_date),
+            'duration': (None, max_duration),
+        }
+        self.exclude_types = frozenset(exclude_types)
+
+    @property
+    def pushed(self):
+        """The property whose bounds go to the datastore, if any."""
+        for prop in RANGE_RANK:
+            if self.bounds[prop] != (None, None):
+                return prop
+        return None
+
+    def _inBounds(self, prop, value):
+        low, high = self.bounds[prop]
+        if low is None and high is None:
+            return True
+        if value is None:
+            return False
+        if low is not None and value < low:
+            return False
+        if high is not None:
+            # the time window excludes its end
+            if value > high or (prop == 'sess_time' and value == high):
+                return False
+        return True
+
+    def matches(self, sess, skip=None):
+        """Return whether sess is in range; skip names a property whose
+        bounds were already applied by the datastore."""
+        if sess.sess_type in self.exclude_types:
+            return False
+        return all(self._inBounds(prop, getattr(sess, prop))
+                   for prop in self.bounds if prop != skip)
+
+    def filter(self, sessions, skip=None):
+        """Yield the sessions in range, in their given order."""
+        for sess in sessions:
+            if self.matches(sess, skip):
+                yield sess
+
+    def query(self, conf_key):
+        """Return the ancestor query applying the pushed bounds."""
+        q = Session.query(ancestor=conf_key)
+        prop = self.pushed
+        if prop is None:
+            return q
+        low, high = self.bounds[prop]
+        model_prop = getattr(Session, prop)
+        if low is not None:
+            q = q.filter(model_prop >= low)
+        if high is not None:
+            if prop == 'sess_time':
+                q = q.filter(model_prop < high)
+            else:
+                q = q.filter(model_prop <= high)
+        return q.order(model_prop)
+
+    def run(self, conf_key):
+        """Yield the sessions of a conference in range, streaming the
+        pushed query's results through the remaining bounds."""
+        return self.filter(self.query(conf_key).iter(), skip=self.pushed)
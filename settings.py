@@ -16,3 +16,7 @@ WEB_CLIENT_ID = '267170457165-stmcnu96aa24kkjdf3vt92icntm99td6.apps.googleuserco
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# OAuth2 tokeninfo endpoint used by utils.getUserId(id_type="oauth");
+# point it at a local fake server when testing.
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
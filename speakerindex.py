@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""speakerindex.py
+
+Udacity conference server-side Python App Engine speaker session index
+
+Each speaker has a SpeakerIndex entity, keyed by normalized email, that
+lists their sessions across all conferences in date and time order, so
+finding a speaker's sessions is one key read plus a batched get. Entries
+are added when a session lists the speaker or a Speaker is created under
+a session. An index is seeded from a query on Session.speakers when it
+is first created, so sessions from before the index are not lost.
+
+$Id$
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import Session
+from models import SpeakerIndex
+
+
+def normalize(email):
+    """Return the index id of a speaker email."""
+    return email.strip().lower()
+
+
+def _sortKey(sess):
+    return '%s %s' % (sess.sess_date or '', sess.sess_time or '')
+
+
+@ndb.tasklet
+def _legacyEntriesAsync(speaker):
+    """Return the index entries of sessions listing speaker, from a
+    query; used to seed a new index."""
+    values = list(set([speaker, normalize(speaker)]))
+    sessions = yield Session.query(Session.speakers.IN(values)).fetch_async()
+    raise ndb.Return([[_sortKey(sess), sess.key.urlsafe()]
+                      for sess in sessions])
+
+
+def _addEntries(key, entries, seed):
+    """Add entries to a SpeakerIndex, creating it from seed entries if
+    it does not exist; run in a transaction."""
+    index = key.get()
+    created = index is None
+    if created:
+        index = SpeakerIndex(key=key, sessions=seed)
+    new_entries = [entry for entry in entries if entry not in index.sessions]
+    if not new_entries and not created:
+        return
+    index.sessions.extend(new_entries)
+    index.sessions.sort()
+    index.put()
+
+
+def addSession(sess, speakers):
+    """Add sess to the SpeakerIndex of every speaker (email) given."""
+    addSessionsAsync([sess], speakers).get_result()
+
+
+@ndb.tasklet
+def addSessionsAsync(sessions, speakers=None):
+    """Add sessions to the SpeakerIndex of their speakers, or of the
+    speakers given; every index is updated once, concurrently."""
+    entries = {}
+    for sess in sessions:
+        for speaker in sess.speakers if speakers is None else speakers:
+            entries.setdefault(normalize(speaker), (speaker, []))[1].append(
+                [_sortKey(sess), sess.key.urlsafe()])
+    keys = [ndb.Key(SpeakerIndex, speaker_id) for speaker_id in entries]
+    indexes = yield ndb.get_multi_async(keys)
+
+    @ndb.tasklet
+    def add(key, index):
+        speaker, speaker_entries = entries[key.id()]
+        seed = []
+        if not index:
+            seed = yield _legacyEntriesAsync(speaker)
+        # each index is its own entity group
+        yield ndb.transaction_async(
+            lambda: _addEntries(key, speaker_entries, seed))
+
+    yield [add(key, index) for key, index in zip(keys, indexes)]
+
+
+def getSessionKeys(speaker, conf_key=None):
+    """Return the session keys of speaker in date and time order, limited
+    to the conference conf_key if given, or None if the speaker has no
+    index yet."""
+    index = ndb.Key(SpeakerIndex, normalize(speaker)).get()
+    if not index:
+        return None
+    s_keys = [ndb.Key(urlsafe=wssk) for _, wssk in index.sessions]
+    if conf_key:
+        s_keys = [s_key for s_key in s_keys if s_key.parent() == conf_key]
+    return s_keys
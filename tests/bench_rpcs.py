@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""bench_rpcs.py
+
+Udacity conference server-side Python App Engine RPC round-trip benchmark
+
+Calls createConference, getConference (with cold and warm caches) and
+createSession against the testbed's local stubs. For each endpoint it
+reports the API calls made, the sequential round trips they took, and
+the wall time. A call started while another is still outstanding shares
+that call's round trip. Run it against a checkout from before the
+tasklet changes with --app-dir to get the "before" numbers:
+
+    APPENGINE_SDK=/path/to/sdk python tests/bench_rpcs.py [--app-dir DIR] [runs]
+
+$Id$
+
+"""
+
+import argparse
+import os
+import time
+
+import sdk
+
+USER_EMAIL = 'organizer@example.com'
+
+
+class RoundTripCounter(object):
+    """RoundTripCounter -- counts API calls and sequential round trips
+    through apiproxy pre/post call hooks"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.round_trips = 0
+        self._outstanding = 0
+
+    def pre(self, service, call, request, response, rpc):
+        if not self._outstanding:
+            self.round_trips += 1
+        self._outstanding += 1
+        self.calls += 1
+
+    def post(self, service, call, request, response, rpc, error):
+        self._outstanding = max(self._outstanding - 1, 0)
+
+    def install(self):
+        from google.appengine.api import apiproxy_stub_map
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'round_trips', self.pre)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'round_trips', self.post)
+
+
+def call(api, name, **fields):
+    """Call endpoint method name of api with a request built from
+    fields; works whatever request container the checkout uses."""
+    method = getattr(api, name)
+    return method(method.remote.request_type(**fields))
+
+
+def coldCaches():
+    """Drop the ndb context cache, memcache and per-instance caches."""
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    import conference
+
+    ndb.get_context().clear_cache()
+    memcache.flush_all()
+    for name in ('CONFERENCE_CACHE', 'SCHEDULE_CACHE'):
+        local = getattr(conference, name, None)
+        if local is not None:
+            local.clear()
+
+
+def measure(counter, label, func, runs, before=None):
+    """Run before() then func() runs times; print the calls and round
+    trips of the last run and the mean wall time."""
+    elapsed = 0.0
+    for _ in range(runs):
+        if before:
+            before()
+        counter.reset()
+        start = time.time()
+        func()
+        elapsed += time.time() - start
+    print('%-24s %6d calls %6d round trips %8.1f ms' % (
+        label, counter.calls, counter.round_trips, elapsed / runs * 1000))
+
+
+def main(app_dir, runs):
+    sdk.setupSdk(app_dir)
+    bed = sdk.activateTestbed(app_dir)
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = USER_EMAIL
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = ''
+    try:
+        from google.appengine.ext import ndb
+        from conference import ConferenceApi
+        from models import Conference
+
+        api = ConferenceApi()
+        counter = RoundTripCounter()
+        counter.install()
+        created = []
+
+        def createConference():
+            name = 'Benchmark %d' % len(created)
+            call(api, 'createConference', name=name, city='London',
+                 topics=['Web'], startDate='2030-05-01',
+                 endDate='2030-05-03', maxAttendees=100)
+            created.append(name)
+
+        measure(counter, 'createConference', createConference, runs)
+        c_key = Conference.query(Conference.name == created[0]).get(
+            keys_only=True)
+        wsck = c_key.urlsafe()
+
+        def getConference():
+            call(api, 'getConference', websafeConferenceKey=wsck)
+
+        measure(counter, 'getConference (cold)', getConference, runs,
+                before=coldCaches)
+        measure(counter, 'getConference (warm)', getConference, runs,
+                before=ndb.get_context().clear_cache)
+
+        def createSession():
+            call(api, 'createSession', websafeConferenceKey=wsck,
+                 name='Session', sess_date='2030-05-02', sess_time='10:00',
+                 duration=60, sess_type='talk')
+
+        measure(counter, 'createSession', createSession, runs)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('runs', nargs='?', type=int, default=20)
+    parser.add_argument('--app-dir', default=sdk.APP_DIR,
+                        help='checkout of the app to benchmark')
+    args = parser.parse_args()
+    main(os.path.abspath(args.app_dir), args.runs)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""bench_serializers.py
+
+Udacity conference server-side Python App Engine serializer benchmark
+
+Times FormSerializer.to_forms (serializers.py) against the reflective
+hasattr/getattr/setattr copy the _copy*ToForm methods used before, on
+in-memory conferences and sessions; nothing is stored. Run with the SDK
+reachable (see sdk.py):
+
+    APPENGINE_SDK=/path/to/sdk python tests/bench_serializers.py [count]
+
+$Id$
+
+"""
+
+import sys
+import timeit
+from datetime import date
+from datetime import time
+
+import sdk
+
+REPEAT = 5
+
+
+def legacyConferenceCopy(conf, displayName, seatsAvailable):
+    """The former ConferenceApi._copyConferenceToForm."""
+    from models import ConferenceForm
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            # convert Date to date string; just copy others
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.seatsAvailable = seatsAvailable
+    if displayName:
+        setattr(cf, 'organizerDisplayName', displayName)
+    cf.check_initialized()
+    return cf
+
+
+def legacySessionCopy(sess):
+    """The former ConferenceApi._copySessionToForm."""
+    from models import SessionForm
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(sess, field.name):
+            if field.name == 'sess_time':
+                setattr(sf, 'sess_time', str(getattr(sess, 'sess_time'))[:5])
+            elif field.name == 'sess_date':
+                setattr(sf, 'sess_date', str(getattr(sess, 'sess_date'))[:10])
+            else:
+                setattr(sf, field.name, getattr(sess, field.name))
+    sf.check_initialized()
+    return sf
+
+
+def buildEntities(count):
+    """Return count in-memory Conferences and Sessions with keys."""
+    from google.appengine.ext import ndb
+    from models import Conference
+    from models import Profile
+    from models import Session
+
+    confs = []
+    sessions = []
+    for i in range(count):
+        p_key = ndb.Key(Profile, 'organizer%d@example.com' % (i % 10))
+        c_key = ndb.Key(Conference, i + 1, parent=p_key)
+        confs.append(Conference(
+            key=c_key, name='Conference %d' % i,
+            description='A conference about things ' * 4,
+            organizerUserId=p_key.id(), topics=['Web', 'Programming'],
+            city='London', startDate=date(2016, 5, 1),
+            endDate=date(2016, 5, 3), month=5, maxAttendees=100,
+            seatsAvailable=50))
+        sessions.append(Session(
+            key=ndb.Key(Session, i + 1, parent=c_key),
+            name='Session %d' % i, speakers=['speaker@example.com'],
+            highlights=['intro'], sess_date=date(2016, 5, 2),
+            sess_time=time(10, 30), duration=60, sess_type='talk',
+            location='Room 1'))
+    return confs, sessions
+
+
+def bench(label, func):
+    """Print and return the best of REPEAT runs of func, in seconds."""
+    best = min(timeit.repeat(func, number=1, repeat=REPEAT))
+    print('%-32s %8.1f ms' % (label, best * 1000))
+    return best
+
+
+def main(count):
+    sdk.setupSdk()
+    bed = sdk.activateTestbed()
+    try:
+        from serializers import CONFERENCE_SERIALIZER
+        from serializers import SESSION_SERIALIZER
+
+        confs, sessions = buildEntities(count)
+        extras = [{'organizerDisplayName': 'Organizer',
+                   'seatsAvailable': conf.seatsAvailable} for conf in confs]
+
+        print('%d entities, best of %d runs' % (count, REPEAT))
+        old = bench('conferences, reflective copy', lambda: [
+            legacyConferenceCopy(conf, 'Organizer', conf.seatsAvailable)
+            for conf in confs])
+        new = bench('conferences, FormSerializer',
+                    lambda: CONFERENCE_SERIALIZER.to_forms(confs, extras))
+        print('%-32s %8.2fx' % ('speed-up', old / new))
+        old = bench('sessions, reflective copy',
+                    lambda: [legacySessionCopy(sess) for sess in sessions])
+        new = bench('sessions, FormSerializer',
+                    lambda: SESSION_SERIALIZER.to_forms(sessions))
+        print('%-32s %8.2fx' % ('speed-up', old / new))
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""sdk.py
+
+Udacity conference server-side Python App Engine local test setup
+
+Puts the App Engine SDK and the app on sys.path, and activates a
+testbed with local datastore, memcache, task queue and mail stubs, for
+the tests and benchmarks in this directory. The SDK is found through
+$APPENGINE_SDK, or the directory holding dev_appserver.py on $PATH.
+
+$Id$
+
+"""
+
+import os
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPLICATION_ID = 'conference-test'
+
+
+def findSdk():
+    """Return the App Engine SDK directory, or None if not found."""
+    sdk_path = os.environ.get('APPENGINE_SDK')
+    if sdk_path:
+        return sdk_path
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        if os.path.exists(os.path.join(path, 'dev_appserver.py')):
+            return os.path.dirname(os.path.realpath(
+                os.path.join(path, 'dev_appserver.py')))
+    return None
+
+
+def setupSdk(app_dir=APP_DIR):
+    """Make the SDK, its bundled libraries and the app in app_dir
+    importable. Raises ImportError if the SDK cannot be found."""
+    sdk_path = findSdk()
+    if sdk_path is None:
+        raise ImportError('App Engine SDK not found; set APPENGINE_SDK')
+    if sdk_path not in sys.path:
+        sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    if app_dir not in sys.path:
+        sys.path.insert(0, app_dir)
+
+
+def activateTestbed(app_dir=APP_DIR):
+    """Activate and return a Testbed with strongly consistent local
+    datastore, memcache, task queue (reading app_dir's queue.yaml) and
+    mail stubs."""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(app_id=APPLICATION_ID, overwrite=True)
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=app_dir)
+    bed.init_mail_stub()
+    bed.init_app_identity_stub()
+    bed.init_urlfetch_stub()
+    bed.init_user_stub()
+    ndb.get_context().clear_cache()
+    return bed
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""test_emailqueue.py
+
+Udacity conference server-side Python App Engine email pipeline tests
+
+Run with the SDK reachable (see sdk.py); skipped otherwise:
+
+    APPENGINE_SDK=/path/to/sdk python -m unittest discover tests
+
+$Id$
+
+"""
+
+import unittest
+from datetime import date
+
+import sdk
+
+
+def setUpModule():
+    try:
+        sdk.setupSdk()
+    except ImportError as e:
+        raise unittest.SkipTest(str(e))
+
+
+class EmailQueueTest(unittest.TestCase):
+    """EmailQueueTest -- drain() against a local mail stand-in"""
+
+    def setUp(self):
+        from google.appengine.ext import testbed
+        import emailqueue
+
+        self.bed = sdk.activateTestbed()
+        self.taskqueue = self.bed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.emailqueue = emailqueue
+        self.sent = []
+        self.failing = set()
+        self.previous = emailqueue.setSender(self.sendMail)
+
+    def tearDown(self):
+        self.emailqueue.setSender(self.previous)
+        self.bed.deactivate()
+
+    def sendMail(self, sender, to, subject, body):
+        if to in self.failing:
+            raise RuntimeError('mail API unavailable')
+        self.sent.append((to, subject, body))
+
+    def createConference(self, name):
+        from models import Conference
+        return Conference(name=name, city='London',
+                          startDate=date(2030, 5, 1),
+                          endDate=date(2030, 5, 3)).put()
+
+    def enqueue(self, to, conf_keys):
+        self.emailqueue.enqueueEmail(
+            self.emailqueue.CONFERENCE_CREATED, to, conf_keys)
+
+    def queuedTasks(self):
+        return self.taskqueue.GetTasks(self.emailqueue.EMAIL_QUEUE)
+
+    def testOneMessagePerRecipient(self):
+        first = self.createConference('First')
+        second = self.createConference('Second')
+        self.enqueue('a@example.com', [first])
+        self.enqueue('a@example.com', [second])
+        self.enqueue('b@example.com', [first])
+
+        self.assertEqual(self.emailqueue.drain(), 3)
+        self.assertEqual(sorted(to for to, _, _ in self.sent),
+                         ['a@example.com', 'b@example.com'])
+        body = dict((to, body) for to, _, body in self.sent)['a@example.com']
+        self.assertIn('First (London, 2030-05-01 - 2030-05-03)', body)
+        self.assertIn('Second (London, 2030-05-01 - 2030-05-03)', body)
+        self.assertEqual(self.queuedTasks(), [])
+
+    def testFailedSendKeepsOnlyItsTasks(self):
+        conf = self.createConference('First')
+        self.enqueue('a@example.com', [conf])
+        self.enqueue('b@example.com', [conf])
+        self.failing.add('b@example.com')
+
+        self.assertEqual(self.emailqueue.drain(), 1)
+        self.assertEqual([to for to, _, _ in self.sent], ['a@example.com'])
+        self.assertEqual(len(self.queuedTasks()), 1)
+
+    def testDeletedConferenceIsNotMailed(self):
+        conf = self.createConference('Gone')
+        conf.delete()
+        self.enqueue('a@example.com', [conf])
+
+        self.assertEqual(self.emailqueue.drain(), 1)
+        self.assertEqual(self.sent, [])
+        self.assertEqual(self.queuedTasks(), [])
+
+    def testSetSenderReturnsPrevious(self):
+        stand_in = lambda sender, to, subject, body: None
+        self.assertEqual(self.emailqueue.setSender(stand_in), self.sendMail)
+        self.assertEqual(self.emailqueue.setSender(self.sendMail), stand_in)
+
+
+if __name__ == '__main__':
+    unittest.main()
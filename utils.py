@@ -1,10 +1,75 @@
+import hashlib
 import json
+import logging
 import os
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
+from cache import LRUCache
 from models import Profile
+from settings import TOKENINFO_URL
+
+# tokeninfo lookups are cached per token for at most MAX_TOKEN_TTL seconds
+# and never beyond the token's own expiry
+MAX_TOKEN_TTL = 3600
+TOKENINFO_DEADLINE = 5
+MEMCACHE_TOKEN_PREFIX = 'TOKEN_USER_ID:'
+TOKEN_CACHE = LRUCache(max_size=1000, ttl=MAX_TOKEN_TTL, name='tokens')
+
+
+def _fetchTokenInfo(token_type, token):
+    """Start an asynchronous tokeninfo lookup; return its RPC."""
+    rpc = urlfetch.create_rpc(deadline=TOKENINFO_DEADLINE)
+    urlfetch.make_fetch_call(
+        rpc, '%s?%s=%s' % (TOKENINFO_URL, token_type, token))
+    return rpc
+
+
+def _getOAuthUserId():
+    """Return the user id of the request's bearer token, cached per token."""
+    auth = os.getenv('HTTP_AUTHORIZATION')
+    bearer, token = auth.split()
+    # never keep raw tokens in the caches
+    token_hash = hashlib.sha256(token).hexdigest()
+
+    cached = TOKEN_CACHE.get(token_hash)
+    if cached is None:
+        cached = memcache.get(MEMCACHE_TOKEN_PREFIX + token_hash)
+        if cached is not None:
+            user_id, expires = cached
+            TOKEN_CACHE.set(token_hash, cached, ttl=expires - time.time())
+    if cached is not None:
+        user_id, expires = cached
+        if expires > time.time():
+            return user_id
+
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    try:
+        resp = _fetchTokenInfo(token_type, token).get_result()
+        if (resp.status_code == 400 and token_type == 'id_token' and
+                'invalid_token' in resp.content):
+            resp = _fetchTokenInfo('access_token', token).get_result()
+    except urlfetch.Error as e:
+        logging.warning('tokeninfo lookup failed: %s', e)
+        return ''
+    if resp.status_code != 200:
+        logging.warning('tokeninfo lookup failed with HTTP %d',
+                        resp.status_code)
+        return ''
+
+    info = json.loads(resp.content)
+    user_id = info.get('user_id', '')
+    ttl = min(int(info.get('expires_in', 0)), MAX_TOKEN_TTL)
+    if user_id and ttl > 0:
+        cached = (user_id, time.time() + ttl)
+        TOKEN_CACHE.set(token_hash, cached, ttl=ttl)
+        memcache.set(MEMCACHE_TOKEN_PREFIX + token_hash, cached, time=ttl)
+    return user_id
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -12,27 +77,7 @@ def getUserId(user, id_type="email"):
 
     if id_type == "oauth":
         """A workaround implementation for getting userid."""
-        auth = os.getenv('HTTP_AUTHORIZATION')
-        bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _getOAuthUserId()
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm
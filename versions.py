@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""versions.py
+
+Udacity conference server-side Python App Engine version numbers for
+conditional reads
+
+Conferences, conference schedules and Profiles carry a version number
+that every write increments. Once a write commits its version is
+published to memcache, so a read that names the version the client
+already holds (knownVersion) is answered "not modified" from memcache
+alone. Versions only ever move forward in memcache; a missing entry
+just means a full read, which publishes the version again.
+
+$Id$
+
+"""
+
+from google.appengine.ext import ndb
+
+import cache
+
+CONFERENCE = 'Conference'
+SCHEDULE = 'Schedule'
+PROFILE = 'Profile'
+MEMCACHE_VERSION_PREFIX = 'VERSION:'
+# seconds a published version is kept
+VERSION_TTL = 600
+
+
+def _key(kind, ident):
+    return '%s%s:%s' % (MEMCACHE_VERSION_PREFIX, kind, ident)
+
+
+def get(kind, ident):
+    """Return the published version of kind ident, None if unknown."""
+    return cache.get(_key(kind, ident))
+
+
+def isCurrent(kind, ident, known_version):
+    """Return True if known_version is the published version of kind
+    ident; False if it is not, or nothing is published."""
+    if known_version is None:
+        return False
+    return get(kind, ident) == known_version
+
+
+def publish(kind, ident, version):
+    """Publish version of kind ident, unless a later one already is."""
+    def later(current):
+        if current is None or version > current:
+            return version
+        return None
+    cache.update(_key(kind, ident), later, VERSION_TTL)
+
+
+def publishOnCommit(kind, ident, version):
+    """Publish version of kind ident once the current transaction
+    commits."""
+    ndb.get_context().call_on_commit(
+        lambda: publish(kind, ident, version))